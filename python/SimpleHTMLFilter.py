@@ -1,6 +1,129 @@
+import os
+import re
 import copy
+import codecs
+from collections import deque, namedtuple
+from collections.abc import Mapping
 from html.parser import HTMLParser
-from functools import partial
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# elements without end tag, a record never stays open on them
+VOID_ELEMENTS = frozenset(('area', 'base', 'br', 'col', 'embed', 'hr', 'img',
+                           'input', 'link', 'meta', 'param', 'source',
+                           'track', 'wbr'))
+
+
+class _Complete(Exception):
+    pass
+
+
+# condition operators, in the order they are tested: the cheap and selective
+# ones first
+MATCH_OPS = ('eq', 'word', 'prefix', 'suffix', 'contains', 'regex', 'exists')
+_EQ, _WORD, _PREFIX, _SUFFIX, _CONTAINS, _REGEX, _EXISTS = range(7)
+_MISSING = object()
+
+
+def _parse_condition(condition):
+    """
+    - True: the value exists
+    - a dict of operator -> argument, e.g. {'prefix': 'http'}, all must hold,
+      'word' looks for a whitespace separated word like a class name
+    - anything else: the value equals it
+    """
+    if condition is True:
+        return [(_EXISTS, None)]
+    if not isinstance(condition, Mapping):
+        return [(_EQ, condition)]
+    tests = []
+    for op, arg in condition.items():
+        assert op in MATCH_OPS, 'Unknown match operator: %s' % op
+        if op == 'regex':
+            arg = re.compile(arg)
+        tests.append((MATCH_OPS.index(op), arg))
+    return tests
+
+
+def _test(op, arg, value):
+    if op == _EQ:
+        return value == arg
+    elif op == _EXISTS:
+        return True
+    elif value is None:
+        return False
+    elif op == _WORD:
+        return arg in value.split()
+    elif op == _PREFIX:
+        return value.startswith(arg)
+    elif op == _SUFFIX:
+        return value.endswith(arg)
+    elif op == _CONTAINS:
+        return arg in value
+    else:
+        return arg.search(value) is not None
+
+
+class AttrMatcher(object):
+    """
+    compiled declarative matcher of a tag filter, called with the attributes
+    of the element as a dict. The spec is either a dict of attribute name ->
+    condition (see _parse_condition) or a list of (attribute name, value)
+    pairs that must all be equal, e.g.
+      {'name': 'app', 'class': {'word': 'item'}, 'href': {'regex': '^/p/'}}
+      [('name', 'app')]
+    """
+    __slots__ = ('tests', )
+    takes_dict = True
+
+    def __init__(self, spec):
+        items = spec.items() if isinstance(spec, Mapping) else spec
+        tests = [(op, name, arg) for name, condition in items
+                 for op, arg in _parse_condition(condition)]
+        tests.sort(key=lambda test: test[0])
+        self.tests = tuple((name, op, arg) for op, name, arg in tests)
+
+    def __call__(self, attrs):
+        for name, op, arg in self.tests:
+            value = attrs.get(name, _MISSING)
+            if value is _MISSING:
+                return False
+            if op == _EQ:
+                if value != arg:
+                    return False
+            elif not _test(op, arg, value):
+                return False
+        return True
+
+
+class TextMatcher(object):
+    """
+    compiled declarative matcher of a data filter, called with the text. The
+    spec is a condition (see _parse_condition), e.g. {'regex': r'\d+'}.
+    """
+    __slots__ = ('tests', )
+    takes_dict = False
+
+    def __init__(self, spec):
+        self.tests = tuple(sorted(_parse_condition(spec),
+                                  key=lambda test: test[0]))
+
+    def __call__(self, data):
+        for op, arg in self.tests:
+            if not _test(op, arg, data):
+                return False
+        return True
+
+
+def compile_matcher(spec, data=False):
+    """
+    :param spec: a declarative matcher, see AttrMatcher and TextMatcher, or
+        a callable that is returned as is
+    :param data: the matcher is for a data filter
+    :return: the matcher
+    """
+    if spec is None or callable(spec):
+        return spec
+    return TextMatcher(spec) if data else AttrMatcher(spec)
 
 
 class SimpleHTMLFilter(HTMLParser):
@@ -74,38 +197,56 @@ P = lambda from_: partial(match_attr, from_=from_)
         HTMLParser.__init__(self)
         HTMLParser.reset(self)
         self._stack = []
-        self._flag_pool = {}
+        self._active = 0
         self._value_pool = {}
+        self._text = []
 
-        self._starttag_handlers = []
-        self._endtag_handlers = []
+        # tag -> [(parent mask, mask, matcher, takes dict, output), ...]
+        self._starttag_handlers = {}
+        # tag -> mask of all the filters on that tag
+        self._endtag_masks = {}
+        # [(parent mask, mask, matcher, output), ...]
         self._data_handlers = []
+        self._filter_count = 0
+        # flags of the top level filters on elements with an end tag
+        self._record_mask = 0
         self._install_filters(filters)
 
+        # streaming state, see iterextract
+        self._records = None
+        self._record = None
+        self._missing = None
+
     def reset(self):
         HTMLParser.reset(self)
         self._stack = []
-        self._flag_pool = {}
+        self._active = 0
         self._value_pool = {}
+        self._text = []
+        self._records = None
+        self._record = None
+        self._missing = None
 
-    @staticmethod
-    def _generate_flag(pre_flag, flag):
-        if not pre_flag:
-            pre_flag = 'filter'
-        return '%s::%s' % (pre_flag, flag)
-
-    def _install_filters(self, filters, ptype=None, pre_flag=None):
+    def _install_filters(self, filters, ptype=None, parent=0):
         """
         HtmlFilter = {
             'tag':
                 - tag handler: tag name
                 - data handler: None
-            'matcher': matcher function that will be called with element attrs
+            'matcher':
+                - matcher function that will be called with element attrs
+                  (or data), or a declarative spec, see compile_matcher
             'out':
                 - attributes: (attr_name, saved_name), ...
                 - data: saved_name
             'descendants': filters, ...
         }
+
+        Each filter gets a bit in the `_active` flags, set while it matches,
+        and a handler in the table of its tag (or in the data handlers) which
+        only runs while the bit of its parent filter is set. Descendants are
+        installed before their parent so they see the parent flags as they
+        were before the current token.
         """
         assert ptype in ('ATTR', 'DATA', None)
         for i in range(len(filters)):
@@ -117,67 +258,182 @@ P = lambda from_: partial(match_attr, from_=from_)
             matcher = html_filter.get('matcher', None)
             output = html_filter.get('out', [])
             descendants = html_filter.get('descendants', [])
-            if not matcher:
-                matcher = lambda x: True
-            new_flag = self._generate_flag(pre_flag, i)
+            # no matcher (None) matches everything
+            matcher = compile_matcher(matcher or None, data=not tag)
+            mask = 1 << self._filter_count
+            self._filter_count += 1
+            if tag and not parent and tag not in VOID_ELEMENTS:
+                self._record_mask |= mask
             if tag:  # Attributes filter
                 if descendants:
-                    self._install_filters(descendants, 'ATTR', new_flag)
-                self._starttag_handlers.append(
-                    partial(self._start_tag, tag_=tag, matcher=matcher,
-                            output=output, pre_flag=pre_flag,
-                            pos_flag=new_flag))
-                self._endtag_handlers.append(
-                    partial(self._end_tag, tag_=tag, flag=new_flag))
+                    self._install_filters(descendants, 'ATTR', mask)
+                self._starttag_handlers.setdefault(tag, []).append(
+                    (parent, mask, matcher,
+                     getattr(matcher, 'takes_dict', False), output))
+                self._endtag_masks[tag] = \
+                    self._endtag_masks.get(tag, 0) | mask
             else:  # Data filter
                 if descendants:
-                    self._install_filters(descendants, 'DATA', new_flag)
-                self._data_handlers.append(
-                    partial(self._handle_data, output=output, matcher=matcher,
-                            pre_flag=pre_flag, pos_flag=new_flag))
+                    self._install_filters(descendants, 'DATA', mask)
+                self._data_handlers.append((parent, mask, matcher, output))
             self._stack.remove(id(html_filter))
 
-    def _start_tag(self, tag, attrs, tag_, matcher, output,
-                   pre_flag=None, pos_flag=None):
-        if pre_flag and not self._flag_pool.get(pre_flag, False):
+    def handle_starttag(self, tag, attrs):
+        self._flush_text()
+        handlers = self._starttag_handlers.get(tag)
+        if not handlers:
             return
-        if tag == tag_:
-            if matcher(attrs):
-                self._flag_pool.update({pos_flag: True})
+        attrs_dict = None
+        for parent, mask, matcher, takes_dict, output in handlers:
+            if parent and not self._active & parent:
+                continue
+            if matcher is None:
+                matched = True
+            elif takes_dict:
+                if attrs_dict is None:
+                    attrs_dict = dict(attrs)
+                matched = matcher(attrs_dict)
+            else:
+                matched = matcher(attrs)
+            if matched:
+                self._active |= mask
                 if output:
-                    attrs = dict(attrs)
+                    if attrs_dict is None:
+                        attrs_dict = dict(attrs)
                     for item in output:
                         key, name = item[0], item[1]
-                        value = attrs.get(key, None)
-                        values = self._value_pool.get(name, [])
-                        values.append(value)
-                        self._value_pool.update({name: values})
+                        self._output(name, attrs_dict.get(key, None))
+        self._check_complete()
+
+    def handle_endtag(self, tag):
+        self._flush_text()
+        mask = self._endtag_masks.get(tag)
+        if mask:
+            self._active &= ~mask
+            if self._record is not None and \
+                    not self._active & self._record_mask:
+                self._records.append(self._record)
+                self._record = None
 
-    def _end_tag(self, tag, tag_, flag):
-        if flag and (tag == tag_):
-            self._flag_pool.pop(flag, None)
+    def handle_data(self, data):
+        # the parser splits text at the end of each fed chunk, so the text is
+        # gathered and matched as a whole at the next markup, or when feed
+        # returns
+        self._text.append(data)
+
+    def handle_comment(self, data):
+        self._flush_text()
+
+    def handle_decl(self, decl):
+        self._flush_text()
+
+    def handle_pi(self, data):
+        self._flush_text()
 
-    def _handle_data(self, data, output, matcher, pre_flag=None, pos_flag=None):
-        if pre_flag and not self._flag_pool.get(pre_flag, False):
+    def unknown_decl(self, data):
+        self._flush_text()
+
+    def feed(self, data):
+        HTMLParser.feed(self, data)
+        # dump() may be called without close(), the text fed so far is
+        # matched now; iterextract feeds its chunks with HTMLParser.feed
+        # instead, to match the text split between chunks as a whole
+        self._flush_text()
+
+    def close(self):
+        HTMLParser.close(self)
+        self._flush_text()
+
+    def _flush_text(self):
+        if not self._text:
             return
-        if matcher(data):
-            self._flag_pool.update({pos_flag: True})
-            if output:
-                values = self._value_pool.get(output, [])
-                values.append(data)
-                self._value_pool.update({output: values})
+        data = ''.join(self._text)
+        self._text = []
+        for parent, mask, matcher, output in self._data_handlers:
+            if parent and not self._active & parent:
+                continue
+            if matcher is None or matcher(data):
+                self._active |= mask
+                if output:
+                    self._output(output, data)
+        self._check_complete()
 
-    def handle_starttag(self, tag, attrs):
-        for handler in self._starttag_handlers:
-            handler(tag, attrs)
+    def _check_complete(self):
+        if self._missing is not None and not self._missing:
+            raise _Complete()
 
-    def handle_endtag(self, tag):
-        for handler in self._endtag_handlers:
-            handler(tag)
+    def _output(self, name, value):
+        self._value_pool.setdefault(name, []).append(value)
+        if self._records is None:
+            return
+        if self._missing:
+            self._missing.discard(name)
+        if self._active & self._record_mask:
+            # inside a matched top level element, wait for it to close
+            if self._record is None:
+                self._record = {}
+            self._record.setdefault(name, []).append(value)
+        else:
+            self._records.append({name: [value]})
 
-    def handle_data(self, data):
-        for handler in self._data_handlers:
-            handler(data)
+    def iterextract(self, source, chunk_size=65536, required=None,
+                    encoding='utf-8'):
+        """
+        parse a document chunk by chunk and yield the values it extracts as
+        records, i.e. dicts of output name -> values. The values found inside
+        an element matched by a top level filter make one record, yielded as
+        soon as the element closes; other values are yielded one by one.
+        Everything is also collected for dump() as usual.
+        :param source: a str, a file like object (read), a socket (recv), or
+            an iterable of chunks; bytes are decoded with encoding
+        :param chunk_size: size of the chunks read from a file or socket
+        :param required: output names, parsing stops as soon as each of them
+            has a value and the pending records are yielded, even partial;
+            the rest of the document is then discarded, so that a later
+            feed starts a new one, and only the extracted values are kept
+        :param encoding: encoding of bytes chunks
+        """
+        if isinstance(source, (str, bytes)):
+            chunks = (source[i:i + chunk_size]
+                      for i in range(0, len(source), chunk_size))
+        elif hasattr(source, 'read'):
+            chunks = iter(lambda: source.read(chunk_size), source.read(0))
+        elif hasattr(source, 'recv'):
+            chunks = iter(lambda: source.recv(chunk_size), b'')
+        else:
+            chunks = source
+        decoder = codecs.getincrementaldecoder(encoding)()
+
+        self._records = deque()
+        self._missing = set(required) if required else None
+        try:
+            try:
+                for chunk in chunks:
+                    if isinstance(chunk, bytes):
+                        chunk = decoder.decode(chunk)
+                    HTMLParser.feed(self, chunk)
+                    while self._records:
+                        yield self._records.popleft()
+                HTMLParser.feed(self, decoder.decode(b'', final=True))
+                self.close()
+            except _Complete:
+                # the unparsed rest and the open elements of the stopped
+                # document, the values found so far are kept for dump()
+                HTMLParser.reset(self)
+                self._stack = []
+                self._active = 0
+                self._text = []
+            if self._record is not None:
+                self._records.append(self._record)
+                self._record = None
+            while self._records:
+                yield self._records.popleft()
+        finally:
+            # also when the caller stops early, so that later feeds are
+            # not streamed
+            self._records = None
+            self._record = None
+            self._missing = None
 
     def validate(self):
         for values in self._value_pool.values():
@@ -185,5 +441,99 @@ P = lambda from_: partial(match_attr, from_=from_)
                 return False
         return True
 
-    def dump(self):
-        return copy.deepcopy(self._value_pool)
\ No newline at end of file
+    def dump(self, deep=True):
+        """
+        :param deep: return a deep copy of the extracted values, otherwise the
+            values collected by the filter itself, that must not be changed
+            and that further parsing keeps adding to.
+        """
+        if not deep:
+            return self._value_pool
+        return copy.deepcopy(self._value_pool)
+
+
+# index: position in the input, source: the path when reading files,
+# values: as returned by dump, error: description of the failure if any
+ExtractResult = namedtuple('ExtractResult',
+                           ['index', 'source', 'values', 'error'])
+
+_worker_filter = None
+
+
+def _init_worker(filters):
+    global _worker_filter
+    _worker_filter = SimpleHTMLFilter(filters)
+
+
+def _extract(html_filter, index, document, from_file, encoding):
+    source = document if from_file else None
+    try:
+        html_filter.reset()
+        if from_file:
+            with open(document, encoding=encoding) as fh:
+                for chunk in iter(lambda: fh.read(65536), ''):
+                    html_filter.feed(chunk)
+        else:
+            if isinstance(document, bytes):
+                document = document.decode(encoding)
+            html_filter.feed(document)
+        html_filter.close()
+        # reset gives the filter a new pool, so this one is ours
+        return ExtractResult(index, source, html_filter.dump(deep=False), None)
+    except Exception as e:
+        return ExtractResult(index, source, None,
+                             '%s: %s' % (type(e).__name__, e))
+
+
+def _extract_in_worker(index, document, from_file, encoding):
+    return _extract(_worker_filter, index, document, from_file, encoding)
+
+
+def extract_many(documents, filters, processes=None, from_files=False,
+                 ordered=True, max_in_flight=None, encoding='utf-8'):
+    """
+    run the same filters over many documents in a process pool. The filters
+    are sent once to each worker process, which compiles them once and
+    reuses the filter for all its documents, so they must be picklable.
+    A document that fails only gets an error in its result.
+    :param documents: an iterable of html (str or bytes), or of paths
+    :param filters: the filters, see SimpleHTMLFilter
+    :param processes: size of the pool, default to the number of cpus; 0 or
+        1 parses in the current process
+    :param from_files: documents are paths of files to read
+    :param ordered: yield the results in the order of the documents, or as
+        soon as they are done
+    :param max_in_flight: most documents handed to the pool but not yet
+        yielded, default to 4 per process
+    :param encoding: encoding of the files and of bytes documents
+    :return: iterator of ExtractResult
+    """
+    if processes is not None and processes <= 1:
+        html_filter = SimpleHTMLFilter(filters)
+        for index, document in enumerate(documents):
+            yield _extract(html_filter, index, document, from_files, encoding)
+        return
+
+    processes = processes or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 4 * processes
+    with ProcessPoolExecutor(processes, initializer=_init_worker,
+                             initargs=(filters, )) as pool:
+        pending = deque()
+        for index, document in enumerate(documents):
+            if len(pending) >= max_in_flight:
+                for result in _collect(pending, ordered):
+                    yield result
+            pending.append(pool.submit(_extract_in_worker, index, document,
+                                       from_files, encoding))
+        while pending:
+            for result in _collect(pending, ordered):
+                yield result
+
+
+def _collect(pending, ordered):
+    if ordered:
+        return [pending.popleft().result()]
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        pending.remove(future)
+    return [future.result() for future in done]
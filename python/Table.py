@@ -1,12 +1,695 @@
+import io
+import os
+import bz2
 import csv
+import sys
+import gzip
+import lzma
+import mmap
+import locale
+from array import array
+import heapq
+from bisect import bisect_left, bisect_right
+from collections import deque
+from functools import partial
+from operator import itemgetter
+from itertools import chain, islice
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
+# each exported chunk is compressed on its own, concatenated gzip members,
+# bz2 streams and xz streams all read back as a single file
+COMPRESSORS = {
+    'gzip': partial(gzip.compress, compresslevel=6),
+    'bz2': bz2.compress,
+    'xz': lzma.compress,
+}
+try:
+    from compression import zstd  # python 3.14+
+    COMPRESSORS['zstd'] = zstd.compress
+except ImportError:
+    pass
 
-class FixedColumnTable(object):
-    def __init__(self, header=None):
+
+class _Column(object):
+    """
+    a single column kept in the most compact container that can hold all of
+    its values:
+    - int (64 bits): array('q')
+    - float: array('d')
+    - str: dictionary encoded, i.e. array('I') of codes plus distinct values
+    - anything else, or a mix of the above: list
+    None is tracked apart in a byte mask so a column stays typed.
+    """
+    __slots__ = ('kind', 'values', 'symbols', 'lookup', 'nulls')
+
+    def __init__(self):
+        self.kind = None
+        self.values = []
+        self.symbols = None
+        self.lookup = None
+        self.nulls = None
+
+    @staticmethod
+    def _kind_of(value):
+        vtype = type(value)
+        if vtype is int:
+            return 'q' if -(1 << 63) <= value < (1 << 63) else 'o'
+        elif vtype is float:
+            return 'd'
+        elif vtype is str:
+            return 's'
+        else:
+            return 'o'
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.values)
+        if self.nulls is not None and self.nulls[index]:
+            return None
+        value = self.values[index]
+        return self.lookup[value] if self.kind == 's' else value
+
+    def __iter__(self):
+        if self.kind == 's':
+            values = map(self.lookup.__getitem__, self.values)
+        else:
+            values = iter(self.values)
+        if self.nulls is None:
+            return values
+        return (None if n else v for v, n in zip(values, self.nulls))
+
+    def __convert(self, kind):
+        old = list(self)
+        self.kind = kind
+        self.nulls = None
+        self.symbols = self.lookup = None
+        if kind in ('q', 'd'):
+            self.values = array(kind)
+        elif kind == 's':
+            self.values = array('I')
+            self.symbols = {}
+            self.lookup = []
+        else:
+            self.values = []
+        for value in old:
+            self.append(value)
+
+    def append(self, value):
+        kind = self.kind
+        if value is not None:
+            new_kind = self._kind_of(value)
+            if new_kind != kind and kind != 'o':
+                self.__convert(new_kind if kind is None else 'o')
+                kind = self.kind
+
+        if kind is None or kind == 'o':
+            self.values.append(value)
+        elif value is None:
+            if self.nulls is None:
+                self.nulls = bytearray(len(self.values))
+            self.nulls.append(1)
+            self.values.append(0)
+        elif kind == 's':
+            code = self.symbols.get(value)
+            if code is None:
+                code = len(self.lookup)
+                self.symbols[value] = code
+                self.lookup.append(value)
+            self.values.append(code)
+        else:
+            self.values.append(value)
+        if self.nulls is not None and len(self.nulls) < len(self.values):
+            self.nulls.append(0)
+
+
+class ColumnarStorage(object):
+    """
+    list like row storage that keeps the cells column by column, see _Column
+    for how each column is stored. Rows are handed out as new lists, so
+    changing a returned row never changes the storage.
+    """
+
+    def __init__(self):
+        self.__columns = []
+        self.__size = 0
+
+    def clear(self):
+        self.__columns = []
+        self.__size = 0
+
+    def append(self, row):
+        if not self.__columns:
+            self.__columns = [_Column() for _ in range(len(row))]
+        assert len(row) == len(self.__columns), 'Invalid row - Wrong width'
+        for column, cell in zip(self.__columns, row):
+            column.append(cell)
+        self.__size += 1
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def column(self, index):
+        return iter(self.__columns[index])
+
+    def __len__(self):
+        return self.__size
+
+    def __getitem__(self, index):
+        if not -self.__size <= index < self.__size:
+            raise IndexError('row index out of range')
+        return [column[index] for column in self.__columns]
+
+    def __iter__(self):
+        return (list(row) for row in zip(*self.__columns))
+
+
+class CsvFileStorage(object):
+    """
+    read only row storage over a memory mapped csv file. Only the byte offset
+    of each row is kept in memory, rows are parsed again whenever they are
+    read. The first row is taken as the header and its length fixes the row
+    width. Rows appended afterwards are kept in memory.
+    """
+
+    def __init__(self, path, dialect=None, encoding=None):
+        self.__encoding = encoding or locale.getpreferredencoding(False)
+        self.__offsets = array('Q')
+        self.__extra = []
+        self.__width = None
+        self.__fh = open(path, 'rb')
+        if os.fstat(self.__fh.fileno()).st_size > 0:
+            self.__mm = mmap.mmap(self.__fh.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        else:
+            self.__mm = b''
+        if dialect is None:
+            sample = self.__mm[:1024].decode(self.__encoding, 'ignore')
+            dialect = csv.Sniffer().sniff(sample)
+        self.__dialect = dialect
+
+    def close(self):
+        if isinstance(self.__mm, mmap.mmap):
+            self.__mm.close()
+        self.__mm = b''
+        self.__fh.close()
+
+    def clear(self):
+        self.close()
+        self.__offsets = array('Q')
+        self.__extra = []
+
+    def __lines(self, pos, cursor=None):
+        mm, encoding = self.__mm, self.__encoding
+        size = len(mm)
+        while pos < size:
+            end = mm.find(b'\n', pos)
+            end = size if end < 0 else end + 1
+            line = mm[pos:end].decode(encoding)
+            pos = end
+            if cursor is not None:
+                cursor[0] = pos
+            yield line
+
+    def index(self):
+        """
+        scan the file once to record where each row starts, the header and
+        then the rows (fitted to the header width) are yielded as parsed.
+        """
+        cursor = [0]
+        reader = csv.reader(self.__lines(0, cursor), self.__dialect)
+        start = 0
+        for row in reader:
+            if row:
+                if self.__width is None:
+                    self.__width = len(row)
+                    yield row
+                else:
+                    self.__offsets.append(start)
+                    yield _fit(row, self.__width)
+            start = cursor[0]
+
+    def append(self, row):
+        self.__extra.append(row)
+
+    def extend(self, rows):
+        self.__extra.extend(rows)
+
+    def __len__(self):
+        return len(self.__offsets) + len(self.__extra)
+
+    def __getitem__(self, index):
+        size = len(self)
+        if not -size <= index < size:
+            raise IndexError('row index out of range')
+        if index < 0:
+            index += size
+        if index >= len(self.__offsets):
+            return self.__extra[index - len(self.__offsets)]
+        lines = self.__lines(self.__offsets[index])
+        return _fit(next(csv.reader(lines, self.__dialect)), self.__width)
+
+    def __iter__(self):
+        if self.__offsets:
+            lines = self.__lines(self.__offsets[0])
+            for row in csv.reader(lines, self.__dialect):
+                if row:
+                    yield _fit(row, self.__width)
+        for row in self.__extra:
+            yield row
+
+
+def _fit(row, width):
+    # If provided data contains more elements than the existing header
+    # then the extra elements will be ignored.
+    new_row = list(row[:width])
+    if len(new_row) < width:
+        new_row.extend([None] * (width - len(new_row)))
+    return new_row
+
+
+def _to_text(row):
+    return tuple([str(v) if v else '' for v in row])
+
+
+def _render(fp, header, space, text_rows, chunk_rows):
+    width = len(space)
+    fmt = ('%%%ds' * width) % tuple(-(v + 3) for v in space)
+    if header:
+        header = [str(v) if v else '' for v in header]
+        header = header[:width] + [''] * (width - len(header))
+        fp.write(fmt % tuple(header) + '\n')
+        fp.write('-' * (sum(space) + 3 * width) + '\n')
+
+    while True:
+        chunk = [fmt % text for text in islice(text_rows, chunk_rows)]
+        if not chunk:
+            break
+        chunk.append('')
+        fp.write('\n'.join(chunk))
+
+
+def _serialize(text_rows, encoding, compress):
+    buf = io.StringIO()
+    csv.writer(buf, 'unix').writerows(text_rows)
+    data = buf.getvalue().encode(encoding)
+    return compress(data) if compress else data
+
+
+def _export(path, append, header, text_rows, compression=None, workers=None,
+            processes=False, chunk_rows=16384):
+    if compression and compression not in COMPRESSORS:
+        raise ValueError('unsupported compression: %s' % compression)
+    compress = COMPRESSORS.get(compression)
+    encoding = locale.getpreferredencoding(False)
+
+    mode = 'wb' if not append else 'ab'
+    with open(path, mode) as fh:
+        if text_rows is None:
+            return
+
+        prefix = []
+        if append:
+            prefix.append(['APPENDED TABLE', ])
+        if header:
+            prefix.append(header)
+        text_rows = chain(prefix, text_rows)
+        chunks = iter(lambda: list(islice(text_rows, chunk_rows)), [])
+
+        if not workers or workers <= 1:
+            for chunk in chunks:
+                fh.write(_serialize(chunk, encoding, compress))
+            return
+
+        # chunks are serialized by the pool and written in order, at most
+        # two chunks per worker are in flight
+        pool_cls = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        pending = deque()
+        with pool_cls(workers) as pool:
+            for chunk in chunks:
+                pending.append(
+                    pool.submit(_serialize, chunk, encoding, compress))
+                if len(pending) >= 2 * workers:
+                    fh.write(pending.popleft().result())
+            while pending:
+                fh.write(pending.popleft().result())
+
+
+AGGREGATES = {
+    'count': len,
+    'sum': sum,
+    'min': lambda values: min(values) if values else None,
+    'max': lambda values: max(values) if values else None,
+    'avg': lambda values: sum(values) / len(values) if values else None,
+}
+
+
+class HashIndex(object):
+    """
+    positions of the rows by the value of a column, for equality lookups.
+    Tables only grow between resets, so the index catches up with the rows
+    appended since its last use instead of being maintained on every insert.
+    """
+
+    def __init__(self, column):
+        self.column = column
+        self.covered = 0
+        self.positions = {}
+
+    def clear(self):
+        self.covered = 0
+        self.positions = {}
+
+    def update(self, rows):
+        end = len(rows)
+        if self.covered == end:
+            return
+        c, positions = self.column, self.positions
+        for i in range(self.covered, end):
+            row = rows[i]
+            value = row[c] if c < len(row) else None
+            if value not in positions:
+                positions[value] = array('Q')
+            positions[value].append(i)
+        self.covered = end
+
+    def lookup(self, value):
+        return self.positions.get(value, ())
+
+
+# up to this number of new rows are inserted one by one in a SortedIndex,
+# more are merged with it
+_INSORT_ROWS = 32
+
+
+class SortedIndex(object):
+    """
+    positions of the rows ordered by the value of a column, for equality and
+    range lookups. None is left out and the other values must be comparable
+    with each other. It catches up like HashIndex.
+    """
+
+    def __init__(self, column):
+        self.column = column
+        self.covered = 0
+        self.keys = []
+        self.positions = array('Q')
+
+    def clear(self):
+        self.covered = 0
+        self.keys = []
+        self.positions = array('Q')
+
+    def update(self, rows):
+        end = len(rows)
+        if self.covered == end:
+            return
+        c = self.column
+        added = []
+        for i in range(self.covered, end):
+            row = rows[i]
+            value = row[c] if c < len(row) else None
+            if value is not None:
+                added.append((value, i))
+        self.covered = end
+        if not added:
+            return
+        added.sort()
+        keys, positions = self.keys, self.positions
+        if not keys or not added[0][0] < keys[-1]:
+            # e.g. dates or ids, which come in order
+            keys.extend([value for value, _ in added])
+            positions.extend([i for _, i in added])
+        elif len(added) <= _INSORT_ROWS:
+            # each insert moves the tail of the lists, which is still much
+            # faster than merging them for a few rows
+            for value, i in added:
+                j = bisect_right(keys, value)
+                keys.insert(j, value)
+                positions.insert(j, i)
+        else:
+            # merged by copying the slices between the new rows, the values
+            # of the index are never compared with each other again
+            merged_keys, merged_positions, start = [], array('Q'), 0
+            for value, i in added:
+                j = bisect_right(keys, value, start)
+                merged_keys += keys[start:j]
+                merged_keys.append(value)
+                merged_positions += positions[start:j]
+                merged_positions.append(i)
+                start = j
+            merged_keys += keys[start:]
+            merged_positions += positions[start:]
+            self.keys, self.positions = merged_keys, merged_positions
+
+    def lookup(self, value):
+        return self.between(value, value)
+
+    def between(self, low, high):
+        start = bisect_left(self.keys, low)
+        end = bisect_right(self.keys, high)
+        return self.positions[start:end]
+
+
+class TableView(object):
+    """
+    a read only selection of the rows of a table in a given order. Only the
+    row positions are kept, cells are read from the table storage when they
+    are needed. Views are made by the query methods of the tables, i.e.
+    sort, filter, top, lookup and between, and can be queried again.
+    """
+
+    def __init__(self, header, rows, selection, space):
+        self.__header = header
+        self.__rows = rows
+        self.__selection = selection
+        self.__space = space
+
+    @property
+    def header(self):
+        return self.__header
+
+    def column_index(self, column):
+        if isinstance(column, int):
+            return column
+        try:
+            return self.__header.index(str(column))
+        except (AttributeError, ValueError):
+            raise KeyError('unknown column: %s' % column)
+
+    def take(self, positions):
+        """
+        :param positions: positions of rows in the table storage
+        :return: a view on these rows of the same table
+        """
+        return TableView(self.__header, self.__rows, positions, self.__space)
+
+    def __cell(self, i, c):
+        row = self.__rows[i]
+        return row[c] if c < len(row) else None
+
+    def __len__(self):
+        return len(self.__selection)
+
+    def __iter__(self):
+        rows, width = self.__rows, len(self.__space)
+        for i in self.__selection:
+            yield _fit(rows[i], width)
+
+    def sort(self, *keys):
+        """
+        stable sort on one or more columns, None sorts after every value
+        :param keys: columns, or (column, descending) pairs, the first one is
+            the primary key
+        :return: the sorted view
+        """
+        order = list(self.__selection)
+        for key in reversed(keys):
+            column, descending = key if isinstance(key, tuple) \
+                else (key, False)
+            c = self.column_index(column)
+            cells = [self.__cell(i, c) for i in order]
+            if descending:
+                positions = sorted(range(len(order)), reverse=True,
+                                   key=lambda j: (cells[j] is not None,
+                                                  cells[j]))
+            else:
+                positions = sorted(range(len(order)),
+                                   key=lambda j: (cells[j] is None, cells[j]))
+            order = [order[j] for j in positions]
+        return self.take(array('Q', order))
+
+    def filter(self, predicate):
+        """
+        :param predicate: called with each row (as list)
+        :return: a view of the rows for which the predicate is true
+        """
+        return self.take(array('Q', (i for i, row in zip(self.__selection,
+                                                          self)
+                                     if predicate(row))))
+
+    def top(self, n, column, largest=True):
+        """
+        :return: a view of the n rows with the largest (or smallest) values of
+            column, ties are kept in order and None is left out
+        """
+        c = self.column_index(column)
+        cells = ((i, self.__cell(i, c)) for i in self.__selection)
+        pick = heapq.nlargest if largest else heapq.nsmallest
+        found = pick(n, ((i, v) for i, v in cells if v is not None),
+                     key=itemgetter(1))
+        return self.take(array('Q', [i for i, _ in found]))
+
+    def group_by(self, keys, aggregates=(('count', None, 'count'), )):
+        """
+        :param keys: a column or a list of columns to group on
+        :param aggregates: (name, column, func) tuples, func is one of
+            AGGREGATES or a callable taking the values of the column in the
+            group, None excluded. A None column aggregates the rows instead.
+        :return: a FixedColumnTable with a row per group, in the order the
+            groups first appear
+        """
+        if not isinstance(keys, (tuple, list)):
+            keys = [keys, ]
+        key_indexes = [self.column_index(k) for k in keys]
+
+        groups = {}
+        for i, row in zip(self.__selection, self):
+            group = tuple(row[c] for c in key_indexes)
+            if group not in groups:
+                groups[group] = array('Q')
+            groups[group].append(i)
+
+        header = [str(k) for k in keys] + [name for name, _, _ in aggregates]
+        table = FixedColumnTable(header)
+        funcs = [(None if column is None else self.column_index(column),
+                  AGGREGATES.get(func, func))
+                 for _, column, func in aggregates]
+        for group, positions in groups.items():
+            row = list(group)
+            for c, func in funcs:
+                if c is None:
+                    row.append(func(positions))
+                    continue
+                values = [self.__cell(i, c) for i in positions]
+                row.append(func([v for v in values if v is not None]))
+            table.add_row(row)
+        return table
+
+    def to_table(self):
+        """
+        :return: a FixedColumnTable holding a copy of the rows
+        """
+        table = FixedColumnTable(self.__header)
+        for row in self:
+            table.add_row(row)
+        return table
+
+    def populate(self):
+        if not self.__space:
+            return
+
+        print('\n\n\n')
+        self.render(sys.stdout)
+
+    def render(self, fp, chunk_rows=4096):
+        """
+        write the view as aligned text, with the column widths of the table
+        """
+        if not self.__space:
+            return
+        _render(fp, self.__header, self.__space, map(_to_text, self),
+                chunk_rows)
+
+    def export2csv(self, path, append=False, **kwargs):
+        """
+        export the view to a csv file, see FixedColumnTable.export2csv
+        """
+        _export(path, append, self.__header,
+                map(_to_text, self) if self.__space else None, **kwargs)
+
+
+class _Queryable(object):
+    """
+    query methods shared by the tables, they work on view() and on the
+    indexes made by create_index.
+    """
+
+    def view(self):
+        raise NotImplementedError
+
+    def sort(self, *keys):
+        return self.view().sort(*keys)
+
+    def filter(self, predicate):
+        return self.view().filter(predicate)
+
+    def top(self, n, column, largest=True):
+        return self.view().top(n, column, largest)
+
+    def group_by(self, keys, aggregates=(('count', None, 'count'), )):
+        return self.view().group_by(keys, aggregates)
+
+    def create_index(self, column, ordered=False):
+        """
+        index a column to speed up lookup, and between if ordered
+        :param column: the column name or position
+        :param ordered: make a SortedIndex instead of a HashIndex
+        """
+        c = self.view().column_index(column)
+        self._indexes[c] = SortedIndex(c) if ordered else HashIndex(c)
+
+    def __index(self, view, column):
+        c = view.column_index(column)
+        index = self._indexes.get(c)
+        if index is not None:
+            index.update(self._rows())
+        return c, index
+
+    def lookup(self, column, value):
+        """
+        :return: a view of the rows where column equals value
+        """
+        view = self.view()
+        c, index = self.__index(view, column)
+        if index is None:
+            return view.filter(lambda row: row[c] == value)
+        return view.take(index.lookup(value))
+
+    def between(self, column, low, high):
+        """
+        :return: a view of the rows where low <= column <= high, ordered by
+            column if it has a SortedIndex
+        """
+        view = self.view()
+        c, index = self.__index(view, column)
+        if not isinstance(index, SortedIndex):
+            return view.filter(
+                lambda row: row[c] is not None and low <= row[c] <= high)
+        return view.take(index.between(low, high))
+
+
+class FixedColumnTable(_Queryable):
+    def __init__(self, header=None, columnar=False, cache_text=False):
+        """
+        :param header: the column names.
+        :param columnar: keep rows in a ColumnarStorage instead of a list of
+            lists, which saves a lot of memory for large numeric or
+            repetitive tables.
+        :param cache_text: keep the text of each row made by add_row, so
+            rendering does not convert the cells again. It takes about three
+            times the memory of the rows, and the rows must not be changed
+            once added.
+        """
         self.__width = 0
         self.__header = header
         self.__space = []
-        self.__data = []
+        self.__data = ColumnarStorage() if columnar else []
+        self.__text = [] if cache_text else None
+        self._indexes = {}
 
         if header:
             self.set_header(header)
@@ -24,82 +707,213 @@ class FixedColumnTable(object):
         self.__header = None
         self.__space.clear()
         self.__data.clear()
+        if self.__text is not None:
+            self.__text.clear()
+        for index in self._indexes.values():
+            index.clear()
+
+    def close(self):
+        """
+        close the csv file of a table loaded with loadfromcsv(lazy=True),
+        its rows cannot be read afterwards; nothing to do for other tables.
+        """
+        if isinstance(self.__data, CsvFileStorage):
+            self.__data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     def add_row(self, data):
         assert isinstance(data, (tuple, list)), 'Invalid data - Must be list'
         if len(data) <= 0:
             return
 
-        new_row = []
-        if self.__width == 0:
-            self.__width = len(data)
+        width = self.__width
+        if width == 0:
+            width = self.__width = len(data)
+            self.__space = [0] * width
 
         # If provided data contains more elements than the existing header
         # then the extra elements will be ignored.
-        for i in range(min(len(data), self.__width)):
-            cell = data[i]
-            new_row.append(cell)
-            self.__space[i] = max(len(str(cell)) if cell else 0,
-                                  self.__space[i])
-        if len(new_row) < self.__width:
-            length = len(new_row)
-            for i in range(self.__width - length):
-                new_row.append(None)
+        if len(data) == width:
+            new_row = list(data)
+        else:
+            new_row = _fit(data, width)
+
+        # each cell is converted to text only once, here
+        text = _to_text(new_row)
+        space = self.__space
+        for i, cell in enumerate(text):
+            if len(cell) > space[i]:
+                space[i] = len(cell)
         self.__data.append(new_row)
+        if self.__text is not None:
+            self.__text.append(text)
+
+    def __measure(self, text_rows):
+        space = self.__space
+        for i, column in enumerate(zip(*text_rows)):
+            space[i] = max(max(map(len, column)), space[i])
+
+    def __add_batch(self, rows):
+        rows = [row for row in rows if len(row) > 0]
+        if not rows:
+            return
+
+        if self.__width == 0:
+            self.__width = len(rows[0])
+            self.__space = [0] * self.__width
+
+        rows = [_fit(row, self.__width) for row in rows]
+        # each cell is converted to text only once, here
+        texts = [_to_text(row) for row in rows]
+        self.__measure(texts)
+        self.__data.extend(rows)
+        if self.__text is not None:
+            self.__text.extend(texts)
+
+    def __len__(self):
+        return len(self.__data)
+
+    def __iter__(self):
+        return iter(self.__data)
+
+    def _rows(self):
+        return self.__data
+
+    def view(self):
+        return TableView(self.__header, self.__data,
+                         range(len(self.__data)), self.__space)
 
     def add_rows(self, data):
         assert isinstance(data, (tuple, list)), 'Invalid data - Must be list'
         if not isinstance(data[0], (tuple, list)):
             self.add_row(data)
             return
-        for row in data:
-            self.add_row(row)
+        assert all(isinstance(row, (tuple, list)) for row in data), \
+            'Invalid data - Must be list'
+        self.__add_batch(data)
+
+    def __text_rows(self):
+        if self.__text is not None:
+            return iter(self.__text)
+        return map(_to_text, self.__data)
 
     def populate(self):
         if self.__width == 0:
             return
 
         print('\n\n\n')
-        pre_fmt = '%%%ds' * self.__width
-        fmt = pre_fmt % tuple(-(v + 3) for v in self.__space)
-        if self.__header:
-            print(fmt % tuple(self.__header))
-            print('-' * (sum(self.__space) + 3 * self.__width))
-        for row in self.__data:
-            cleaned = [str(v) if v else '' for v in row]
-            print(fmt % tuple(cleaned))
+        self.render(sys.stdout)
 
-    def export2csv(self, path, append=False):
+    def render(self, fp, chunk_rows=4096):
+        """
+        write the table as aligned text into a text stream
+        :param fp: any object with a write method taking str
+        :param chunk_rows: number of rows joined into one write call
+        :return: None
+        """
+        if self.__width == 0:
+            return
+        _render(fp, self.__header, self.__space, self.__text_rows(),
+                chunk_rows)
+
+    @staticmethod
+    def render_rows(fp, rows, header=None, sample=None, chunk_rows=4096):
+        """
+        write rows as an aligned text table without keeping them in memory,
+        the column widths are computed before rendering in either way:
+        - rows is a callable returning a new iterable each time: a first pass
+          over it measures all the cells, the second pass renders them
+        - rows is an iterable: only the first sample (default 1000) rows are
+          measured, any later cell wider than its column is written as is
+        :param fp: any object with a write method taking str
+        :param rows: rows as list or tuple, see above
+        :param header: the column names
+        :param sample: number of leading rows used to compute widths
+        :param chunk_rows: number of rows joined into one write call
+        :return: None
+        """
+        if callable(rows):
+            measured, rows = rows(), rows()
+        else:
+            rows = iter(rows)
+            measured = list(islice(rows, sample or 1000))
+            rows = chain(measured, rows)
+
+        space = [len(str(v)) if v else 0 for v in header] if header else []
+        for row in measured:
+            text = _to_text(row)
+            if len(text) > len(space):
+                space.extend([0] * (len(text) - len(space)))
+            for i in range(len(text)):
+                space[i] = max(len(text[i]), space[i])
+        if not space:
+            return
+
+        def pad(text):
+            if len(text) < len(space):
+                return text + ('',) * (len(space) - len(text))
+            return text[:len(space)]
+
+        _render(fp, header, space, (pad(_to_text(row)) for row in rows),
+                chunk_rows)
+
+    def export2csv(self, path, append=False, compression=None, workers=None,
+                   processes=False, chunk_rows=16384):
         """
         export the table to a csv file, note that the object will be represented
         as string by calling str method
         :param path: the file path for exporting
         :param append: indicates whether to append or override
+        :param compression: one of COMPRESSORS, e.g. 'gzip'
+        :param workers: serialize and compress chunks of rows in a pool of
+            this size, the chunks are still written in order
+        :param processes: use a process pool instead of a thread pool, the
+            csv serialization only scales with processes while compression
+            already does with threads
+        :param chunk_rows: number of rows written at once
         :return: None
         """
-        def clean(raw_list):
-            for i in range(len(raw_list)):
-                raw_list[i] = str(raw_list[i]) if raw_list[i] else ''
-            return raw_list
-
-        mode = 'w' if not append else 'a'
-        with open(path, mode, newline='') as fh:
-            if self.__width == 0:
-                return
-
-            writer = csv.writer(fh, 'unix')
-            if append:
-                writer.writerow(['APPENDED TABLE', ])
-            if self.__header:
-                writer.writerow(self.__header)
-            for row in self.__data:
-                row = clean(row)
-                writer.writerow(row)
+        _export(path, append, self.__header,
+                self.__text_rows() if self.__width else None,
+                compression, workers, processes, chunk_rows)
 
     @classmethod
-    def loadfromcsv(cls, path):
-        with open(path, 'r', newline='') as fh:
+    def loadfromcsv(cls, path, lazy=False, batch_rows=8192, encoding=None,
+                    **kwargs):
+        """
+        load a table from a csv file, the first row is taken as header
+        :param path: the csv file path
+        :param lazy: memory map the file and keep only the offset of each row,
+            rows are parsed again from the file whenever the table is rendered
+            or exported. The file is open until close() or reset() is called,
+            or the table is used in a with statement; no kwargs are taken
+        :param batch_rows: number of rows read and measured at once
+        :param encoding: the file encoding, default to the locale one
+        :param kwargs: passed to the constructor, e.g. columnar
+        :return: the table
+        """
+        if lazy:
+            if kwargs:
+                raise TypeError('a lazy table takes no %s'
+                                % ', '.join(sorted(kwargs)))
             inst = cls()
+            storage = CsvFileStorage(path, encoding=encoding)
+            inst.__data = storage
+            rows = storage.index()
+            inst.set_header(next(rows))
+            while True:
+                batch = list(islice(rows, batch_rows))
+                if not batch:
+                    return inst
+                inst.__measure([_to_text(row) for row in batch])
+
+        with open(path, 'r', newline='', encoding=encoding) as fh:
+            inst = cls(**kwargs)
 
             dialect = csv.Sniffer().sniff(fh.read(1024))
             fh.seek(0)
@@ -107,24 +921,28 @@ class FixedColumnTable(object):
 
             header = next(reader)
             inst.set_header(header)
-            for row in reader:
-                inst.add_row(row)
+            while True:
+                batch = list(islice(reader, batch_rows))
+                if not batch:
+                    return inst
+                inst.__add_batch(batch)
 
-            return inst
 
-
-class ExtensibleColumnTable(object):
+class ExtensibleColumnTable(_Queryable):
     def __init__(self):
         self.__header = []
+        self.__index = {}
+        self.__space = []
         self.__data = []
-        self.__table = FixedColumnTable()
-        self.__wrapped = False
+        self._indexes = {}
 
     def reset(self):
         self.__header.clear()
+        self.__index.clear()
+        self.__space.clear()
         self.__data.clear()
-        self.__table.reset()
-        self.__wrapped = False
+        for index in self._indexes.values():
+            index.clear()
 
     def add(self, zipped_record):
         if not zipped_record:
@@ -134,37 +952,66 @@ class ExtensibleColumnTable(object):
         assert isinstance(zipped_record[0], (tuple, list)), \
             'Each value MUST be zipped, i.e. in the format of (k, v)'
 
-        if not self.__header:
-            record = []
-        else:
-            record = [None for _ in range(len(self.__header))]
-
+        header, index = self.__header, self.__index
+        record = [None] * len(header)
         for k, v in zipped_record:
-            if not k:
-                self.add(('NO_COLUMN_NAME_ASSIGNED', v))
-            if str(k) in self.__header:
-                index = self.__header.index(k)
-                record[index] = v
-            else:
-                self.__header.append(str(k))
-                record.append(v)
+            k = str(k) if k else 'NO_COLUMN_NAME_ASSIGNED'
+            i = index.get(k)
+            if i is None:
+                i = index[k] = len(header)
+                header.append(k)
+                self.__space.append(len(k))
+                record.append(None)
+            record[i] = v
+
+        # widths are kept up to date on every record, so the table can be
+        # rendered or exported at any time straight from the records
+        space = self.__space
+        for i, text in enumerate(_to_text(record)):
+            space[i] = max(len(text), space[i])
         self.__data.append(tuple(record))
 
-    def __wrap_into_fixed_column(self):
-        self.__table.reset()
-        self.__table.set_header(self.__header)
-        self.__table.add_rows(self.__data)
-        self.__wrapped = True
+    def __len__(self):
+        return len(self.__data)
+
+    def _rows(self):
+        return self.__data
+
+    def view(self):
+        return TableView(self.__header, self.__data,
+                         range(len(self.__data)), self.__space)
+
+    def __text_rows(self):
+        # records added before a column existed are shorter than the header
+        width = len(self.__header)
+        for record in self.__data:
+            text = _to_text(record)
+            if len(text) < width:
+                text += ('', ) * (width - len(text))
+            yield text
 
     def populate(self):
         if not self.__header or not self.__data:
             return
 
-        if not self.__wrapped:
-            self.__wrap_into_fixed_column()
-        self.__table.populate()
+        print('\n\n\n')
+        self.render(sys.stdout)
+
+    def render(self, fp, chunk_rows=4096):
+        """
+        write the table as aligned text into a text stream, see
+        FixedColumnTable.render
+        """
+        if not self.__header or not self.__data:
+            return
+        _render(fp, self.__header, self.__space, self.__text_rows(),
+                chunk_rows)
 
-    def export2csv(self, path, append=False):
-        if not self.__wrapped:
-            self.__wrap_into_fixed_column()
-        self.__table.export2csv(path, append)
+    def export2csv(self, path, append=False, compression=None, workers=None,
+                   processes=False, chunk_rows=16384):
+        """
+        export the table to a csv file, see FixedColumnTable.export2csv
+        """
+        _export(path, append, self.__header,
+                self.__text_rows() if self.__header else None,
+                compression, workers, processes, chunk_rows)
@@ -0,0 +1,572 @@
+# coding=utf-8
+
+"""
+Micro benchmarks for the code in this directory, e.g.
+  python benchmark.py table
+  python benchmark.py --json html html-handlers > html.json
+"""
+
+import sys
+import json
+import time
+import logging
+import random
+import tempfile
+import threading
+import tracemalloc
+import socketserver
+from html.parser import HTMLParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+from Table import FixedColumnTable
+from drill import DrillRestfulClient
+from util import T, T_many, MailSender
+from config import Configuration, CompactConfiguration
+from SimpleHTMLFilter import SimpleHTMLFilter, compile_matcher
+
+
+def measure(func, *args, **kwargs):
+    """
+    call func and return (result, seconds, current bytes, peak bytes), where
+    the memory is what has been allocated by the call and is still alive.
+    """
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, current, peak
+
+
+def bench_table_storage(rows=200000):
+    """
+    compare the list of lists layout of FixedColumnTable against the
+    columnar one, on a typical report table: ids, amounts, a low cardinality
+    text column and a sparse column.
+    """
+    cities = ['beijing', 'shanghai', 'shenzhen', 'hangzhou', 'chengdu']
+    header = ['id', 'amount', 'city', 'sparse']
+
+    results = []
+    for columnar in (False, True):
+        def build():
+            # rows are made inside the measurement, as they would be when
+            # read from a file or a database
+            table = FixedColumnTable(header, columnar=columnar)
+            for i in range(rows):
+                table.add_row([i, random.random() * 1000,
+                               random.choice(cities),
+                               i if i % 7 == 0 else None])
+            return table
+
+        table, elapsed, current, _ = measure(build)
+        start = time.perf_counter()
+        for _ in table:
+            pass
+        scan = time.perf_counter() - start
+        results.append({
+            'layout': 'columnar' if columnar else 'list',
+            'rows': rows,
+            'memory_mb': round(current / 1048576.0, 2),
+            'insert_rows_per_sec': int(rows / elapsed),
+            'scan_rows_per_sec': int(rows / scan),
+        })
+    return results
+
+
+def bench_config_lookup(lookups=200000):
+    """
+    latency of a repeated dotted key lookup, with the parsed key cache
+    cleared before every lookup (the cost of parsing and validating the key
+    on each call) and with the cache in use.
+    """
+    conf = Configuration({'db': {'pool': {'size': 10}}})
+    key = 'db.pool.size'
+
+    def cold():
+        clear = config._parse_key.cache_clear
+        for _ in range(lookups):
+            clear()
+            conf[key]
+
+    def warm():
+        for _ in range(lookups):
+            conf[key]
+
+    results = []
+    for name, func in (('uncached', cold), ('cached', warm)):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        results.append({
+            'key_cache': name,
+            'lookups': lookups,
+            'ns_per_lookup': int(elapsed * 1e9 / lookups),
+        })
+    return results
+
+
+def bench_config_memory(groups=2000, flags=50):
+    """
+    memory and build time of a large feature flag tree, as nested
+    Configuration dicts and as CompactConfiguration nodes. The leaves are
+    shared by both, so only the node overhead is compared.
+    """
+    tree = dict(('group%d' % g, dict(('flag%d' % f, {
+        'enabled': f % 2 == 0,
+        'rollout': f,
+        'owner': 'team%d' % (f % 7),
+    }) for f in range(flags))) for g in range(groups))
+    key = 'group%d.flag%d.rollout' % (groups // 2, flags // 2)
+
+    results = []
+    for cls in (Configuration, CompactConfiguration):
+        build = cls if cls is Configuration else cls.from_mapping
+        conf, elapsed, current, _ = measure(build, tree)
+        start = time.perf_counter()
+        for _ in range(100000):
+            conf[key]
+        lookup = time.perf_counter() - start
+        results.append({
+            'layout': cls.__name__,
+            'leaves': groups * flags * 3,
+            'memory_mb': round(current / 1048576.0, 2),
+            'build_sec': round(elapsed, 3),
+            'ns_per_lookup': int(lookup * 1e9 / 100000),
+        })
+    return results
+
+
+def make_html(size_kb, depth, seed=0):
+    """
+    a synthetic page of about size_kb of product cards, each card nested in
+    depth divs.
+    """
+    rnd = random.Random(seed)
+    parts, size, n = ['<html><body>'], 0, 0
+    while size < size_kb * 1024:
+        card = ['<div class="level%d box">' % d for d in range(depth)]
+        card.append('<ul>')
+        for _ in range(5):
+            n += 1
+            card.append('<li class="item %s" data-id="%d"><a href="/p/%d">'
+                        'Item %d</a><span class="price">%d</span></li>'
+                        % (rnd.choice(['new', 'hot', 'old']), n, n, n,
+                           rnd.randint(1, 999)))
+        card.append('</ul>')
+        card.extend(['</div>'] * depth)
+        card = ''.join(card)
+        parts.append(card)
+        size += len(card)
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+
+def make_filters(count, depth):
+    """
+    count top level filters of various depths (up to depth, at most 4) over
+    the cards of make_html, each one extracting ids, links and titles.
+    """
+    filters = []
+    for i in range(count):
+        node = {
+            'tag': 'li',
+            'matcher': {'data-id': {'prefix': str(i % 10)}},
+            'out': [('data-id', 'id%d' % i)],
+            'descendants': [{
+                'tag': 'a',
+                'matcher': {'href': {'regex': r'^/p/\d+$'}},
+                'out': [('href', 'link%d' % i)],
+                'descendants': [{'out': 'title%d' % i}],
+            }],
+        }
+        for d in reversed(range(min(depth, i % 4 + 1))):
+            node = {'tag': 'div',
+                    'matcher': {'class': {'word': 'level%d' % d}},
+                    'descendants': [node]}
+        filters.append(node)
+    return filters
+
+
+class _TokenCounter(HTMLParser):
+    def reset(self):
+        HTMLParser.reset(self)
+        self.tokens = 0
+
+    def handle_starttag(self, tag, attrs):
+        self.tokens += 1
+
+    def handle_endtag(self, tag):
+        self.tokens += 1
+
+    def handle_data(self, data):
+        self.tokens += 1
+
+
+def _parse(filters, html):
+    html_filter = SimpleHTMLFilter(filters)
+    html_filter.feed(html)
+    html_filter.close()
+    return html_filter
+
+
+def bench_html(sizes=(16, 256, 1024), depths=(4, 16), filter_counts=(4, 32)):
+    """
+    SimpleHTMLFilter throughput over synthetic pages of several sizes (KB),
+    nesting depths and numbers of filters.
+    """
+    results = []
+    for size_kb in sizes:
+        for depth in depths:
+            html = make_html(size_kb, depth)
+            counter = _TokenCounter()
+            counter.feed(html)
+            counter.close()
+            for count in filter_counts:
+                filters = make_filters(count, depth)
+                _, _, _, peak = measure(_parse, filters, html)
+                docs = max(1, 256 // size_kb)
+                start = time.perf_counter()
+                for _ in range(docs):
+                    _parse(filters, html)
+                elapsed = time.perf_counter() - start
+                results.append({
+                    'size_kb': size_kb,
+                    'depth': depth,
+                    'filters': count,
+                    'tokens': counter.tokens,
+                    'tokens_per_sec': int(counter.tokens * docs / elapsed),
+                    'docs_per_sec': round(docs / elapsed, 2),
+                    'peak_mb': round(peak / 1048576.0, 2),
+                })
+    return results
+
+
+class _CountingMatcher(object):
+    """
+    wraps the matcher of a filter to count its calls, matches and time.
+    """
+
+    def __init__(self, path, tag, matcher):
+        self.path = path
+        self.tag = tag
+        self.matcher = matcher
+        self.takes_dict = getattr(matcher, 'takes_dict', False)
+        self.calls = 0
+        self.hits = 0
+        self.ns = 0
+
+    def __call__(self, value):
+        start = time.perf_counter_ns()
+        matched = self.matcher is None or self.matcher(value)
+        self.ns += time.perf_counter_ns() - start
+        self.calls += 1
+        self.hits += bool(matched)
+        return matched
+
+
+def _instrument(filters, counters, prefix='filter'):
+    instrumented = []
+    for i, html_filter in enumerate(filters):
+        html_filter = dict(html_filter)
+        path = '%s/%d' % (prefix, i)
+        tag = html_filter.get('tag')
+        matcher = compile_matcher(html_filter.get('matcher') or None,
+                                  data=not tag)
+        counter = _CountingMatcher(path, tag, matcher)
+        counters.append(counter)
+        html_filter['matcher'] = counter
+        html_filter['descendants'] = _instrument(
+            html_filter.get('descendants', []), counters, path)
+        instrumented.append(html_filter)
+    return instrumented
+
+
+def bench_html_handlers(size_kb=256, depth=8, count=16):
+    """
+    hot path counters: the calls, matches and matcher time of each filter
+    while parsing one synthetic page, the most expensive first.
+    """
+    html = make_html(size_kb, depth)
+    counters = []
+    _parse(_instrument(make_filters(count, depth), counters), html)
+    counters.sort(key=lambda c: c.ns, reverse=True)
+    return [{
+        'filter': c.path,
+        'tag': c.tag or '(data)',
+        'calls': c.calls,
+        'hits': c.hits,
+        'total_ms': round(c.ns / 1e6, 3),
+        'ns_per_call': int(c.ns / c.calls) if c.calls else 0,
+    } for c in counters]
+
+
+def bench_text(count=1000000):
+    """
+    T called on each value against T_many on all of them, over mixed table
+    cells: mostly text, then numbers, bytes and nulls.
+    """
+    rnd = random.Random(0)
+    makers = [lambda i: 'name%d' % i] * 5 + [
+        lambda i: i, lambda i: i * 0.5, lambda i: b'code%d' % i,
+        lambda i: None]
+    values = [rnd.choice(makers)(i) for i in range(count)]
+
+    results = []
+    for name, func in (('T', lambda: [T(v) for v in values]),
+                       ('T_many', lambda: T_many(values))):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        results.append({
+            'function': name,
+            'values': count,
+            'seconds': round(elapsed, 3),
+            'ns_per_value': int(elapsed * 1e9 / count),
+        })
+    return results
+
+
+class _DrillHandler(BaseHTTPRequestHandler):
+    """
+    a stand-in of the drill REST api: any login is accepted, and every query
+    takes server.delay seconds and returns one row. The ALTER SESSION of
+    the store format is recorded with the CTAS sent after it.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def __reply(self, body, headers=()):
+        body = body.encode('utf-8')
+        self.send_response(200)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path == '/j_security_check':
+            return self.__reply('Log Out', [('Set-Cookie', 'JSESSIONID=1')])
+        query = json.loads(body.decode('utf-8'))['query']
+        server = self.server
+        if query.startswith('ALTER SESSION'):
+            server.store_format = query.rsplit("'", 2)[-2]
+        elif query.startswith('CREATE TABLE'):
+            server.ctas.append((query.split()[2], server.store_format))
+        time.sleep(server.delay)
+        self.__reply(json.dumps({'columns': ['q'], 'rows': [{'q': query}]}))
+
+
+def bench_drill(queries=16, delay=0.05, parallelism=4):
+    """
+    DrillRestfulClient against a local stand-in of drill, whose queries take
+    delay seconds each: query_many of plain queries against the same queries
+    one by one, then of CTAS statements with a store format each, run at
+    once, which must all be written in their own format.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _DrillHandler)
+    server.daemon_threads = True
+    server.delay = delay
+    server.store_format = None
+    server.ctas = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host = 'http://127.0.0.1:%d' % server.server_address[1]
+
+    results = []
+    try:
+        with DrillRestfulClient(host, 'bench', 'bench',
+                                parallelism=parallelism) as client:
+            selects = ['select %d' % i for i in range(queries)]
+
+            def one_by_one():
+                return [client.query(q, as_frame=False) for q in selects]
+
+            formats = ['parquet', 'json', 'csv']
+
+            def ctas_at_once():
+                futures = [client.submit('CREATE TABLE t%d AS select 1' % i,
+                                         formats[i % len(formats)], False)
+                           for i in range(queries)]
+                return [f.result() for f in futures]
+
+            for name, func in (
+                    ('query', one_by_one),
+                    ('query_many',
+                     lambda: client.query_many(selects, as_frame=False)),
+                    ('submit CTAS', ctas_at_once)):
+                del server.ctas[:]
+                start = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - start
+                wrong = sum(fmt != formats[int(table[1:]) % len(formats)]
+                            for table, fmt in server.ctas)
+                results.append({
+                    'run': name,
+                    'queries': queries,
+                    'delay_ms': int(delay * 1000),
+                    'seconds': round(elapsed, 3),
+                    'queries_per_sec': round(queries / elapsed, 1),
+                    'wrong_format': wrong,
+                })
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    """
+    a stand-in of an smtp server without authentication: each mail takes
+    server.delay seconds, the recipients containing 'refused' are refused
+    with a 550, and one mail in server.fail_every is answered with a 451.
+    """
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.wfile.write(b'220 bench\r\n')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'DATA':
+                self.wfile.write(b'354 go on\r\n')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                time.sleep(server.delay)
+                with server.lock:
+                    server.attempts += 1
+                    failed = server.fail_every and \
+                        server.attempts % server.fail_every == 0
+                    if not failed:
+                        server.mails += 1
+                self.wfile.write(b'451 try again\r\n' if failed
+                                 else b'250 sent\r\n')
+            elif command == b'RCPT' and b'refused' in line:
+                self.wfile.write(b'550 no such user\r\n')
+            elif command == b'QUIT':
+                self.wfile.write(b'221 bye\r\n')
+                return
+            else:
+                self.wfile.write(b'250 ok\r\n')
+
+
+def bench_mail(mails=64, delay=0.01, connections=4):
+    """
+    MailSender against a local stand-in of an smtp server, whose mails take
+    delay seconds each, with one attachment: mails sent one by one, then
+    submitted to the workers, then with a transient 451 reply to one mail in
+    four, which is retried, and with refused recipients, which are not. The
+    warnings logged for them are left out.
+    """
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _SmtpHandler)
+    server.daemon_threads = True
+    server.delay = delay
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    mail_config = {'host': '127.0.0.1', 'port': server.server_address[1],
+                   'user': 'bench@localhost'}
+
+    results = []
+    with tempfile.NamedTemporaryFile(suffix='.csv') as attachment:
+        attachment.write(b'id,amount\n' * 10000)
+        attachment.flush()
+        path = attachment.name
+        logging.disable(logging.ERROR)
+        try:
+            with MailSender(mail_config, connections, retries=3,
+                            backoff=0.01) as sender:
+                def submit_all(recipient):
+                    futures = [sender.submit('report', [recipient], 'body',
+                                             path) for _ in range(mails)]
+                    failed = 0
+                    for future in futures:
+                        try:
+                            future.result()
+                        except Exception:
+                            failed += 1
+                    return failed
+
+                for name, fail_every, func in (
+                        ('send', 0, lambda: sum(
+                            bool(sender.send('report', ['a@localhost'],
+                                             'body', path))
+                            for _ in range(mails))),
+                        ('submit', 0, lambda: submit_all('a@localhost')),
+                        ('submit, 451 replies', 4,
+                         lambda: submit_all('a@localhost')),
+                        ('submit, refused', 0,
+                         lambda: submit_all('refused@localhost'))):
+                    server.connections = server.mails = server.attempts = 0
+                    server.fail_every = fail_every
+                    start = time.perf_counter()
+                    failed = func()
+                    elapsed = time.perf_counter() - start
+                    results.append({
+                        'run': name,
+                        'mails': mails,
+                        'delay_ms': int(delay * 1000),
+                        'seconds': round(elapsed, 3),
+                        'mails_per_sec': round(mails / elapsed, 1),
+                        'delivered': server.mails,
+                        'failed': failed,
+                        'connections': server.connections,
+                    })
+        finally:
+            logging.disable(logging.NOTSET)
+            server.shutdown()
+            server.server_close()
+    return results
+
+
+BENCHMARKS = {
+    'table': bench_table_storage,
+    'config': bench_config_lookup,
+    'config-memory': bench_config_memory,
+    'html': bench_html,
+    'html-handlers': bench_html_handlers,
+    'text': bench_text,
+    'drill': bench_drill,
+    'mail': bench_mail,
+}
+
+
+def report(results):
+    table = FixedColumnTable(list(results[0].keys()))
+    table.add_rows([list(r.values()) for r in results])
+    table.populate()
+
+
+def main(argv):
+    """
+    :param argv: benchmark names, all by default; with --json the results
+        are printed as one json object of name -> list of result rows
+    """
+    as_json = '--json' in argv
+    names = [name for name in argv if name != '--json'] or sorted(BENCHMARKS)
+    results = {}
+    for name in names:
+        results[name] = BENCHMARKS[name]()
+        if not as_json:
+            report(results[name])
+    if as_json:
+        json.dump({
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'results': results,
+        }, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
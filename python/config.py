@@ -1,14 +1,50 @@
 # coding=utf-8
 
+import os
 import re
+import sys
 import six
 import json
+import pickle
+import hashlib
+import logging
+import threading
+from bisect import bisect_left
+from functools import lru_cache
+from collections.abc import Mapping, MutableMapping
 
 
 class ConfigKeyError(Exception):
     pass
 
 
+class ConfigFrozenError(TypeError):
+    pass
+
+
+_KEY_PATTERN = re.compile(r'^[a-zA-Z_$][a-zA-Z\d_$]*'
+                          r'(\.[a-zA-Z_$][a-zA-Z\d_$]*)*$')
+
+
+@lru_cache(maxsize=4096)
+def _parse_key(name):
+    if not _KEY_PATTERN.match(name):
+        raise ConfigKeyError('illegal configuration key: %s' % name)
+    return tuple(name.split('.'))
+
+
+def parse_key(name):
+    """
+    validate a configuration key and split it into its names, the result of
+    the most recent keys is cached.
+    :param name: a dotted key, e.g. 'db.pool.size'
+    :return: tuple of names, e.g. ('db', 'pool', 'size')
+    """
+    if not isinstance(name, six.text_type):
+        raise ConfigKeyError('configuration key must be string: %s' % name)
+    return _parse_key(name)
+
+
 class Configuration(dict):
     """
     A dict like object only allows keys as string, and the keys should be
@@ -35,25 +71,10 @@ class Configuration(dict):
 
     @staticmethod
     def __make_configurable(configurable):
-        def make(item):
-            if isinstance(item, dict):
-                for k, v in item.items():
-                    k = str(k)
-                    v = make(v)
-                    item[k] = v
-                return Configuration(item)
-            elif isinstance(item, (list, tuple)):
-                for i in range(len(item)):
-                    item[i] = make(item[i])
-                return item
-            else:
-                return item
-
+        # nested nodes are built once, bottom up, see _build
         assert isinstance(configurable, Configuration)
-        for key, value in configurable.items():
-            key = str(key)
-            value = make(value)
-            configurable[key] = value
+        for key, value in list(dict.items(configurable)):
+            configurable[str(key)] = _build(value)
 
     @staticmethod
     def from_file(files):
@@ -62,14 +83,8 @@ class Configuration(dict):
 
         container = {}
         for p in files:
-            d = {}
-            six.exec_(p, d)
-            container.update(d)
-
-        try:
-            del container['__builtins__']
-        except KeyError:
-            pass
+            with open(p) as fh:
+                container.update(_exec_source(fh.read(), p))
         return Configuration(container)
 
     @staticmethod
@@ -84,28 +99,73 @@ class Configuration(dict):
                 container.update(json.loads(content))
         return Configuration(container)
 
+    @staticmethod
+    def load(files, cache_dir=None):
+        """
+        load layered json (*.json) or python files, unlike from_json and
+        from_file every layer is deep merged into the previous ones. The
+        Configuration nodes are built while parsing.
+        :param files: a path or a list of paths, later layers win
+        :param cache_dir: keep each parsed layer in this directory as a
+            pickle, keyed by path, mtime, size and content hash, so unchanged
+            layers are not parsed again; layers that cannot be pickled are
+            not cached. Only point it to a directory you trust.
+        :return: the merged Configuration
+        """
+        if not isinstance(files, (list, tuple)):
+            files = [files, ]
+
+        result = Configuration()
+        for p in files:
+            _merge(result, _load_layer(p, cache_dir))
+        return result
+
+    @classmethod
+    def _from_pairs(cls, pairs):
+        node = cls()
+        for k, v in pairs:
+            k = str(k)
+            if len(parse_key(k)) > 1:
+                node[k] = v  # dotted key, nested like __setitem__ does
+            else:
+                dict.__setitem__(node, k, v)
+        return node
+
+    def __reduce__(self):
+        return _restore, (list(dict.items(self)), )
+
     def to_json(self, path):
         with open(path, 'w') as fh:
             fh.write(json.dumps(self, indent=2, sort_keys=True))
 
+    def freeze(self):
+        """
+        :return: an immutable FrozenConfiguration snapshot of the current
+            content, later changes of this object are not reflected.
+        """
+        return FrozenConfiguration.from_mapping(self)
+
+    def compact(self):
+        """
+        :return: a CompactConfiguration copy of the content
+        """
+        return CompactConfiguration.from_mapping(self)
+
     def __find_container(self, names):
         container = self
-        while names:
-            name = names.pop(0)
-            if name in container:
+        for name in names:
+            if super(Configuration, container).__contains__(name):
                 container = super(Configuration, container).__getitem__(name)
                 if not isinstance(container, Configuration):
                     return name
             else:
                 return name
-        else:
-            return container
+        return container
 
     def __getitem__(self, item):
-        self.__check_name(item)
-        names = item.split('.')
-        entry = names.pop()
-        container = self.__find_container(names)
+        names = parse_key(item)
+        entry = names[-1]
+        container = self.__find_container(names[:-1])
         if isinstance(container, Configuration):
             if super(Configuration, container).__contains__(entry):
                 return super(Configuration, container).__getitem__(entry)
@@ -115,22 +175,19 @@ class Configuration(dict):
             raise KeyError('key not found: %s (%s)' % (container, item))
 
     def __setitem__(self, key, value):
-        self.__check_name(key)
-        names = key.split('.')
-        entry = names.pop()
+        names = parse_key(key)
+        entry = names[-1]
         container = self
-        while names:
-            name = names.pop(0)
+        for name in names[:-1]:
             if name not in container:
                 container[name] = Configuration()
             container = container.get(name)
         super(Configuration, container).__setitem__(entry, value)
 
     def __delitem__(self, key):
-        self.__check_name(key)
-        names = key.split('.')
-        entry = names.pop()
-        container = self.__find_container(names)
+        names = parse_key(key)
+        entry = names[-1]
+        container = self.__find_container(names[:-1])
         if isinstance(container, Configuration):
             super(Configuration, container).__delitem__(entry)
         else:
@@ -138,13 +195,12 @@ class Configuration(dict):
 
     def __contains__(self, item):
         try:
-            self.__check_name(item)
+            names = parse_key(item)
         except ConfigKeyError:
             return False
         else:
-            names = item.split('.')
-            entry = names.pop()
-            container = self.__find_container(names)
+            entry = names[-1]
+            container = self.__find_container(names[:-1])
             if isinstance(container, Configuration):
                 return super(Configuration, container).__contains__(entry)
             else:
@@ -152,13 +208,12 @@ class Configuration(dict):
 
     def get(self, k, d=None):
         try:
-            self.__check_name(k)
+            names = parse_key(k)
         except ConfigKeyError:
             return d
         else:
-            names = k.split('.')
-            entry = names.pop()
-            container = self.__find_container(names)
+            entry = names[-1]
+            container = self.__find_container(names[:-1])
             if isinstance(container, Configuration):
                 return super(Configuration, container).get(entry, d)
             else:
@@ -172,11 +227,592 @@ class Configuration(dict):
     def has_key(self, k):
         return self.__contains__(k)
 
+
+# the value of the nested nodes in the flat index of FrozenConfiguration
+_NODE = object()
+
+
+class FrozenConfiguration(Mapping):
+    """
+    An immutable snapshot of a Configuration, see Configuration.freeze.
+
+    Every key path of the tree, e.g. 'a', 'a.b' and 'a.b.c', is indexed in a
+    flat dict shared by the whole snapshot, so reading a dotted key is a
+    single dict lookup, and a sub tree is a view on the same index with a key
+    prefix. Lists become tuples; other leaf values are shared with the
+    source, so the snapshot is only as immutable as they are.
+    """
+    __slots__ = ('_flat', '_children', '_prefix')
+
+    def __init__(self, flat, children, prefix=''):
+        self._flat = flat
+        self._children = children
+        self._prefix = prefix
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        if isinstance(mapping, FrozenConfiguration):
+            return mapping
+
+        flat, children = {}, {}
+        cls._index(flat, children, '', mapping)
+        return cls(flat, children, '')
+
+    @classmethod
+    def _index(cls, flat, children, prefix, node):
+        """
+        add the key paths of node, a dict, under prefix ('' or 'a.b.') to
+        the flat index and the names of its keys to children.
+        """
+        def freeze_value(value):
+            if isinstance(value, dict):
+                return cls.from_mapping(value)
+            elif isinstance(value, (list, tuple)):
+                return tuple(freeze_value(v) for v in value)
+            else:
+                return value
+
+        names = []
+        for k, v in dict.items(node):
+            k = str(k)
+            names.append(k)
+            path = prefix + k
+            if isinstance(v, dict):
+                cls._index(flat, children, path + '.', v)
+                flat[path] = _NODE
+            else:
+                flat[path] = freeze_value(v)
+        children[prefix] = tuple(names)
+
+    def _paths(self, path):
+        """
+        :return: the key path and the paths below it
+        """
+        paths = [path]
+        if self._flat.get(path) is _NODE:
+            for k in self._children[path + '.']:
+                paths.extend(self._paths(path + '.' + k))
+        return paths
+
+    def _replace(self, mapping, keys):
+        """
+        a new snapshot with the top level keys taken from mapping, or
+        removed if they are not in it; only their sub trees are indexed
+        again, the rest of the index is copied.
+        :return: (the new snapshot, the sorted changed key paths)
+        """
+        flat, children = dict(self._flat), dict(self._children)
+        paths = set()
+        for k in keys:
+            if k in self._flat:
+                for path in self._paths(k):
+                    paths.add(path)
+                    del flat[path]
+                    children.pop(path + '.', None)
+        names = [k for k in self._children[''] if k not in keys or
+                 k in mapping]
+        names.extend(k for k in mapping if k in keys and
+                     k not in self._flat)
+        cls = type(self)
+        cls._index(flat, children, '',
+                   dict((k, mapping[k]) for k in keys if k in mapping))
+        children[''] = tuple(names)
+        new = cls(flat, children, '')
+        for k in keys:
+            if k in flat:
+                paths.update(new._paths(k))
+        return new, _changed_paths(self, new, paths)
+
+    def __getitem__(self, item):
+        try:
+            value = self._flat[self._prefix + item]
+        except (KeyError, TypeError):
+            parse_key(item)
+            raise KeyError('key not found: %s' % item)
+        if value is _NODE:
+            return type(self)(self._flat, self._children,
+                              self._prefix + item + '.')
+        return value
+
+    def get(self, k, d=None):
+        try:
+            value = self._flat.get(self._prefix + k, d)
+        except TypeError:
+            return d
+        if value is _NODE:
+            return type(self)(self._flat, self._children,
+                              self._prefix + k + '.')
+        return value
+
+    def __contains__(self, item):
+        try:
+            return (self._prefix + item) in self._flat
+        except TypeError:
+            return False
+
+    def __iter__(self):
+        return iter(self._children[self._prefix])
+
+    def __len__(self):
+        return len(self._children[self._prefix])
+
+    def __setitem__(self, key, value):
+        raise ConfigFrozenError('frozen configuration is read only: %s' % key)
+
+    def __delitem__(self, key):
+        raise ConfigFrozenError('frozen configuration is read only: %s' % key)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.to_dict())
+
+    def to_dict(self):
+        def unfreeze(value):
+            if isinstance(value, FrozenConfiguration):
+                return value.to_dict()
+            elif isinstance(value, tuple):
+                return [unfreeze(v) for v in value]
+            else:
+                return value
+
+        return dict((k, unfreeze(self[k])) for k in self)
+
+    def to_json(self, path):
+        with open(path, 'w') as fh:
+            fh.write(json.dumps(self.to_dict(), indent=2, sort_keys=True))
+
+    def freeze(self):
+        return self
+
+    def thaw(self):
+        """
+        :return: a mutable Configuration with a copy of the content
+        """
+        return Configuration(self.to_dict())
+
+
+def _restore(items):
+    node = Configuration()
+    dict.update(node, items)
+    return node
+
+
+def _exec_source(source, path):
+    d = {}
+    six.exec_(compile(source, path, 'exec'), d)
+    d.pop('__builtins__', None)
+    return d
+
+
+def _build(value):
+    if isinstance(value, dict):
+        return Configuration._from_pairs(
+            (k, _build(v)) for k, v in value.items())
+    elif isinstance(value, list):
+        return [_build(v) for v in value]
+    else:
+        return value
+
+
+def _parse_layer(path, source):
+    if path.endswith('.json'):
+        return json.loads(source,
+                          object_pairs_hook=Configuration._from_pairs)
+    return _build(_exec_source(source, path))
+
+
+def _merge(base, layer):
+    for k, v in dict.items(layer):
+        current = dict.get(base, k)
+        if isinstance(current, Configuration) and \
+                isinstance(v, Configuration):
+            _merge(current, v)
+        else:
+            dict.__setitem__(base, k, v)
+    return base
+
+
+_LAYER_CACHE_VERSION = 1
+
+
+def _load_layer(path, cache_dir=None):
+    if not cache_dir:
+        with open(path, 'rb') as fh:
+            return _parse_layer(path, fh.read())
+
+    path = os.path.abspath(path)
+    name = hashlib.sha1(path.encode('utf-8')).hexdigest() + '.pickle'
+    cache = os.path.join(cache_dir, name)
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+
+    # entry: (version, stamp, content hash, parsed layer)
+    try:
+        with open(cache, 'rb') as fh:
+            entry = pickle.load(fh)
+        if entry[0] != _LAYER_CACHE_VERSION:
+            entry = None
+    except Exception:
+        entry = None
+    if entry and entry[1] == stamp:
+        return entry[3]
+
+    with open(path, 'rb') as fh:
+        source = fh.read()
+    digest = hashlib.sha1(source).hexdigest()
+    if entry and entry[2] == digest:
+        layer = entry[3]  # touched but not changed
+    else:
+        layer = _parse_layer(path, source)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        data = pickle.dumps((_LAYER_CACHE_VERSION, stamp, digest, layer),
+                            pickle.HIGHEST_PROTOCOL)
+        tmp = '%s.%d.tmp' % (cache, os.getpid())
+        with open(tmp, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp, cache)
+    except Exception:
+        logging.debug('cannot cache configuration %s' % path, exc_info=True)
+    return layer
+
+
+def _changed_paths(old, new, paths):
+    changed = []
+    for path in paths:
+        a, b = old._flat.get(path, old), new._flat.get(path, new)
+        if a is _NODE and b is _NODE:
+            continue  # the leaves below tell what has changed
+        if a is old or b is new or a != b:
+            changed.append(path)
+    return sorted(changed)
+
+
+class ReloadableConfiguration(object):
+    """
+    A configuration loaded from layered files, later files override the top
+    level keys of earlier ones like Configuration.from_json, and reloaded
+    whenever one of them changes.
+
+    The files are polled for a change of mtime or size, by calling check() or
+    by the thread started with start(), and only the changed files are parsed
+    again, with their keys checked as Configuration does. Only the top level
+    keys that a changed file defines, or defined, and that no later file
+    overrides are indexed again and compared. Each reload publishes a new
+    FrozenConfiguration by replacing the `snapshot` reference, so readers
+    never take a lock; keep the snapshot in a local variable to read several
+    keys consistently.
+    """
+
+    def __init__(self, files, interval=1.0):
+        if not isinstance(files, (list, tuple)):
+            files = [files, ]
+        self.__files = list(files)
+        self.__interval = interval
+        self.__stats = {}
+        self.__layers = {}
+        self.__subscribers = ()
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__thread = None
+
+        container = {}
+        for path in self.__files:
+            self.__stats[path] = self.__stat(path)
+            self.__layers[path] = _load_layer(path)
+            container.update(self.__layers[path])
+        self.snapshot = FrozenConfiguration.from_mapping(container)
+
     @staticmethod
-    def __check_name(name):
-        regex = re.compile('^[a-zA-Z_$][a-zA-Z\d_$]*'
-                           '(\.[a-zA-Z_$][a-zA-Z\d_$]*)*$')
-        if not isinstance(name, six.text_type):
-            raise ConfigKeyError('configuration key must be string: %s' % name)
-        if not regex.match(name):
-            raise ConfigKeyError('illegal configuration key: %s' % name)
+    def __stat(path):
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+
+    def __owners(self, layers, keys):
+        """
+        :return: {key: the last file defining it} for the given top level keys
+        """
+        owners = {}
+        for path in self.__files:
+            for k in keys:
+                if k in layers[path]:
+                    owners[k] = path
+        return owners
+
+    def __getitem__(self, item):
+        return self.snapshot[item]
+
+    def __contains__(self, item):
+        return item in self.snapshot
+
+    def get(self, k, d=None):
+        return self.snapshot.get(k, d)
+
+    def subscribe(self, prefix, callback):
+        """
+        :param prefix: a key, e.g. 'db.pool', the callback is called when it
+            or any key below it changes; '' for any change.
+        :param callback: called with the new snapshot and the sorted list of
+            the changed key paths under prefix.
+        """
+        with self.__lock:
+            self.__subscribers += ((prefix, callback), )
+
+    def check(self):
+        """
+        reload the changed files, a file that is gone or cannot be parsed
+        keeps its previous content until it changes again.
+        :return: the changed key paths
+        """
+        with self.__lock:
+            updated, keys = set(), set()
+            layers = dict(self.__layers)
+            for path in self.__files:
+                try:
+                    stat = self.__stat(path)
+                except OSError:
+                    stat = None
+                if stat == self.__stats[path]:
+                    continue
+                self.__stats[path] = stat
+                if stat is None:
+                    logging.warning('configuration file is gone: %s' % path)
+                    continue
+                try:
+                    layer = _load_layer(path)
+                except Exception:
+                    logging.exception('error in reloading %s' % path)
+                    continue
+                keys.update(self.__layers[path])
+                keys.update(layer)
+                self.__layers[path] = layer
+                updated.add(path)
+            if not updated:
+                return []
+
+            # keys overridden by a later file, which has not changed, keep
+            # their value
+            old_owners = self.__owners(layers, keys)
+            owners = self.__owners(self.__layers, keys)
+            keys = set(k for k in keys if owners.get(k) in updated or
+                       old_owners.get(k) in updated)
+            container = dict((k, self.__layers[owners[k]][k])
+                             for k in keys if k in owners)
+            new, changed = self.snapshot._replace(container, keys)
+            self.snapshot = new
+            subscribers = self.__subscribers
+
+        for prefix, callback in subscribers:
+            keys = [k for k in changed if not prefix or k == prefix or
+                    k.startswith(prefix + '.')]
+            if keys:
+                try:
+                    callback(new, keys)
+                except Exception:
+                    logging.exception('error in configuration subscriber')
+        return changed
+
+    def start(self):
+        if self.__thread is not None:
+            return
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__watch,
+                                         name='config-reload', daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        if self.__thread is None:
+            return
+        self.__stop.set()
+        self.__thread.join()
+        self.__thread = None
+
+    def __watch(self):
+        while not self.__stop.wait(self.__interval):
+            self.check()
+
+
+class _KeyTable(object):
+    """
+    process wide table of the key names used by CompactConfiguration nodes,
+    each distinct name is stored once and referred to by its position. The
+    sorted key tuples of the nodes built from mappings (their shapes) are
+    interned as well, as large trees repeat the same few sets of keys over
+    and over; the shapes made by later writes are not, so that they do not
+    pile up in the table.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        self.shapes = {}
+        self.lock = threading.Lock()
+
+    def shape(self, keys):
+        shape = self.shapes.get(keys)
+        if shape is None:
+            with self.lock:
+                shape = self.shapes.setdefault(keys, keys)
+        return shape
+
+    def intern(self, name):
+        i = self.ids.get(name)
+        if i is None:
+            with self.lock:
+                i = self.ids.get(name)
+                if i is None:
+                    i = len(self.names)
+                    self.names.append(sys.intern(name))
+                    self.ids[self.names[i]] = i
+        return i
+
+
+_KEYS = _KeyTable()
+
+
+def _compact(value):
+    if isinstance(value, dict):
+        return CompactConfiguration.from_mapping(value)
+    elif isinstance(value, list):
+        return [_compact(v) for v in value]
+    else:
+        return value
+
+
+class CompactConfiguration(MutableMapping):
+    """
+    A Configuration with the same dotted key API and a much smaller memory
+    footprint for large trees. A node has no dict: its keys are a sorted
+    tuple of ids into a key table, shared by all the nodes with the same
+    keys, and its values a tuple. Keys are iterated in the order they were
+    first seen by the process, not in insertion order. Writes rebuild the
+    node, so it suits read mostly trees.
+    """
+    __slots__ = ('_keys', '_values')
+
+    def __init__(self, iterable=(), **kwargs):
+        self._keys = ()
+        self._values = ()
+        if iterable or kwargs:
+            node = self.from_mapping(dict(iterable, **kwargs))
+            self._keys, self._values = node._keys, node._values
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        node = cls()
+        pairs, dotted = [], []
+        for k, v in mapping.items():
+            k = str(k)
+            if len(parse_key(k)) > 1:
+                dotted.append((k, v))
+            else:
+                pairs.append((_KEYS.intern(k), _compact(v)))
+        pairs.sort(key=lambda pair: pair[0])
+        node._keys = _KEYS.shape(tuple(k for k, _ in pairs))
+        node._values = tuple(v for _, v in pairs)
+        for k, v in dotted:
+            node[k] = v
+        return node
+
+    def __position(self, name):
+        i = _KEYS.ids.get(name)
+        if i is not None:
+            pos = bisect_left(self._keys, i)
+            if pos < len(self._keys) and self._keys[pos] == i:
+                return pos
+        return -1
+
+    def __find_container(self, names):
+        node = self
+        for name in names:
+            pos = node.__position(name)
+            if pos < 0:
+                return name
+            node = node._values[pos]
+            if not isinstance(node, CompactConfiguration):
+                return name
+        return node
+
+    def __getitem__(self, item):
+        names = parse_key(item)
+        container = self.__find_container(names[:-1])
+        if isinstance(container, CompactConfiguration):
+            pos = container.__position(names[-1])
+            if pos >= 0:
+                return container._values[pos]
+            raise KeyError('key not found: %s (%s)' % (names[-1], item))
+        raise KeyError('key not found: %s (%s)' % (container, item))
+
+    def get(self, k, d=None):
+        try:
+            return self[k]
+        except (KeyError, ConfigKeyError):
+            return d
+
+    def __contains__(self, item):
+        try:
+            self[item]
+        except (KeyError, ConfigKeyError):
+            return False
+        return True
+
+    def __set(self, name, value):
+        i = _KEYS.intern(name)
+        pos = bisect_left(self._keys, i)
+        values = self._values
+        keys = self._keys
+        if pos < len(keys) and keys[pos] == i:
+            self._values = values[:pos] + (value, ) + values[pos + 1:]
+        else:
+            self._keys = keys[:pos] + (i, ) + keys[pos:]
+            self._values = values[:pos] + (value, ) + values[pos:]
+
+    def __setitem__(self, key, value):
+        names = parse_key(key)
+        node = self
+        for name in names[:-1]:
+            pos = node.__position(name)
+            if pos < 0 or \
+                    not isinstance(node._values[pos], CompactConfiguration):
+                child = CompactConfiguration()
+                node.__set(name, child)
+                node = child
+            else:
+                node = node._values[pos]
+        node.__set(names[-1], _compact(value))
+
+    def __delitem__(self, key):
+        names = parse_key(key)
+        container = self.__find_container(names[:-1])
+        pos = -1
+        if isinstance(container, CompactConfiguration):
+            pos = container.__position(names[-1])
+        if pos < 0:
+            raise KeyError('key not found: %s' % key)
+        keys, values = container._keys, container._values
+        container._keys = keys[:pos] + keys[pos + 1:]
+        container._values = values[:pos] + values[pos + 1:]
+
+    def __iter__(self):
+        names = _KEYS.names
+        return (names[i] for i in self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.to_dict())
+
+    def to_dict(self):
+        def expand(value):
+            if isinstance(value, CompactConfiguration):
+                return value.to_dict()
+            elif isinstance(value, list):
+                return [expand(v) for v in value]
+            else:
+                return value
+
+        return dict((k, expand(v)) for k, v in zip(self, self._values))
+
+    def to_configuration(self):
+        return Configuration(self.to_dict())
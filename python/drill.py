@@ -1,61 +1,592 @@
 # coding=utf-8
 
+import os
+import re
 import json
+import time
+import codecs
+import pickle
+import hashlib
 import logging
+import threading
 import requests
-from pandas import DataFrame
+from itertools import chain
+from collections import OrderedDict
+from pandas import DataFrame, concat, to_numeric
+from requests.adapters import HTTPAdapter
+from concurrent.futures import Future, ThreadPoolExecutor
 
 
 class DrillRemoteException(Exception):
     pass
 
 
+_WHITESPACES = re.compile(r'[ \t\n\r]*')
+
+
+class _JsonReader(object):
+    """
+    reads json values one by one out of text chunks.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def __fill(self):
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        :return: the next character which is not a whitespace
+        """
+        while True:
+            self.pos = _WHITESPACES.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.__fill():
+                raise ValueError('unexpected end of json')
+
+    def expect(self, c):
+        if self.peek() != c:
+            raise ValueError('expecting %r: %r' %
+                             (c, self.buf[self.pos:self.pos + 32]))
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a number at the end of the buffer may go on in the next
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            self.__fill()
+
+
+def _iter_result(chunks):
+    """
+    parse the json object of a drill query result out of text chunks, and
+    yield (key, value) for its entries, but ('rows', row) for each row.
+    :raise ValueError: if the text is not a json object
+    """
+    reader = _JsonReader(chunks)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key == 'rows' and reader.peek() == '[':
+            reader.expect('[')
+            if reader.peek() != ']':
+                while True:
+                    yield key, reader.value()
+                    if reader.peek() != ',':
+                        break
+                    reader.expect(',')
+            reader.expect(']')
+        else:
+            yield key, reader.value()
+        if reader.peek() != ',':
+            break
+        reader.expect(',')
+    reader.expect('}')
+
+
+# the dtypes of the numeric types of drill, the others are kept as they
+# are sent, decimals too so that no digit is lost
+_DTYPES = {
+    'TINYINT': 'Int64', 'SMALLINT': 'Int64', 'INT': 'Int64',
+    'INTEGER': 'Int64', 'BIGINT': 'Int64', 'UINT1': 'Int64',
+    'UINT2': 'Int64', 'UINT4': 'Int64', 'FLOAT': 'float64',
+    'FLOAT4': 'float64', 'FLOAT8': 'float64', 'DOUBLE': 'float64',
+    'REAL': 'float64',
+}
+_ZERO_PADDED = re.compile(r'[-+]?0\d')
+
+
+def _metadata_dtypes(columns, metadata):
+    """
+    :return: column -> dtype of the drill types in the metadata of a
+        result, None for a column kept as it is
+    """
+    return dict((column, _DTYPES.get(str(kind).split('(')[0].upper()))
+                for column, kind in zip(columns, metadata))
+
+
+def _numeric(column, values, dtype):
+    try:
+        return to_numeric(values, dtype_backend='numpy_nullable').astype(dtype)
+    except (ValueError, TypeError):
+        raise ValueError('column %s is not of type %s in every row'
+                         % (column, dtype))
+
+
+def _frame(columns, rows, dtypes=None):
+    """
+    the rows, dicts of column -> value, as a dataframe with a column per
+    column name.
+    :param dtypes: column -> dtype of the numeric columns, None for the
+        others. The columns not in it yet are typed by their values here,
+        as Int64 or float64 if they are all numbers without leading zeros,
+        and added to it so that the next chunks of the result get the same
+        types; a column without any value yet is left for the next chunk.
+    """
+    if columns is None:
+        columns = list(rows[0].keys()) if rows else []
+    data = {}
+    for column in columns:
+        values = [row.get(column) for row in rows]
+        if dtypes is not None:
+            if column in dtypes:
+                if dtypes[column] is not None:
+                    values = _numeric(column, values, dtypes[column])
+            elif all(v is None for v in values):
+                # typed by the first chunk with a value
+                pass
+            elif any(isinstance(v, bool) or
+                     isinstance(v, str) and _ZERO_PADDED.match(v)
+                     for v in values):
+                # booleans are no numbers, and codes such as zip codes
+                # would lose their zeros
+                dtypes[column] = None
+            else:
+                try:
+                    values = to_numeric(values,
+                                        dtype_backend='numpy_nullable')
+                except (ValueError, TypeError):
+                    dtypes[column] = None
+                else:
+                    dtypes[column] = 'Int64' \
+                        if values.dtype.kind in 'iu' else 'float64'
+                    values = values.astype(dtypes[column])
+        data[column] = values
+    return DataFrame(data, columns=columns)
+
+
+_QUOTED = re.compile(r"""('(?:[^']|'')*'|"[^"]*"|`[^`]*`)""")
+_NAME = r'(?:`[^`]+`|[\w$]+)(?:\s*\.\s*(?:`[^`]+`|[\w$]+))*'
+_TABLES = re.compile(r'\b(?:from|join)\s+(%s)' % _NAME, re.I)
+_WRITTEN_TABLE = re.compile(
+    r'^(?:create\s+(?:or\s+replace\s+)?(?:temporary\s+)?(?:table|view)|'
+    r'drop\s+(?:table|view)|insert\s+into|refresh\s+table\s+metadata)'
+    r'(?:\s+if\s+(?:not\s+)?exists)?\s+(%s)' % _NAME, re.I)
+_CACHEABLE = re.compile(r'^\(*\s*(?:select|with|values)\b', re.I)
+
+
+def _normalize_query(query_string):
+    """
+    the query with its whitespaces, out of quotes, collapsed and without
+    the ending semicolon.
+    """
+    parts = _QUOTED.split(query_string.strip().rstrip(';'))
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r'\s+', ' ', parts[i])
+    return ''.join(parts).strip()
+
+
+def _table_name(name):
+    return re.sub(r'\s*\.\s*', '.', name.replace('`', '')).lower()
+
+
+def _written_table(query_string):
+    """
+    the table written by a CTAS, INSERT, DROP... statement, or None.
+    """
+    m = _WRITTEN_TABLE.match(_normalize_query(query_string))
+    return _table_name(m.group(1)) if m else None
+
+
+def _copy(value):
+    # the cached results must not be changed by the callers
+    if isinstance(value, DataFrame):
+        return value.copy()
+    if isinstance(value, list):
+        return [dict(row) for row in value]
+    return value
+
+
+class DrillResultCache(object):
+    """
+    an opt-in cache of query results for DrillRestfulClient, e.g.
+        cache = DrillResultCache(ttl=60, spill_dir='/tmp/drill-cache')
+        client = DrillRestfulClient(host, user, pwd, cache=cache)
+    - only SELECT, WITH and VALUES queries are cached, keyed by the query
+      text with its whitespaces normalized, the drill host and user, the
+      store.format and the kind of result
+    - results expire after ttl seconds, the least recently used are evicted
+      beyond max_entries, to spill_dir if given, where max_spilled of them
+      are kept as pickled dataframes (the column blocks of the frame)
+    - queries run at the same time with the same key are run once
+    - results are invalidated by table name, which the client does itself
+      for the tables it writes (CTAS, INSERT, DROP...)
+    A cache may be shared by several clients. The spilled results are read
+    back with pickle, only point spill_dir to a directory you trust.
+    """
+
+    def __init__(self, ttl=300.0, max_entries=128, spill_dir=None,
+                 max_spilled=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.spill_dir = spill_dir
+        self.max_spilled = max_spilled
+        if spill_dir and not os.path.isdir(spill_dir):
+            os.makedirs(spill_dir)
+        # key -> (expires, tables, value or spill file path)
+        self.__entries = OrderedDict()
+        self.__spilled = OrderedDict()
+        self.__running = {}
+        self.__invalidations = 0
+        self.__lock = threading.Lock()
+        self.__stats = dict.fromkeys(('hits', 'disk_hits', 'misses',
+                                      'shared', 'expired', 'evicted',
+                                      'spilled', 'invalidated'), 0)
+
+    @staticmethod
+    def cacheable(query_string):
+        return bool(_CACHEABLE.match(_normalize_query(query_string)))
+
+    def __lookup(self, key):
+        """
+        :return: (found, value), or (False, spilled entry) for a result on
+            disk, which is taken out of the spilled ones to be read
+        """
+        now = time.time()
+        entry = self.__entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self.__entries.move_to_end(key)
+                self.__stats['hits'] += 1
+                return True, entry[2]
+            del self.__entries[key]
+            self.__stats['expired'] += 1
+        entry = self.__spilled.pop(key, None)
+        if entry is not None and entry[0] <= now:
+            _remove(entry[2])
+            self.__stats['expired'] += 1
+            entry = None
+        return False, entry
+
+    @staticmethod
+    def __load(path):
+        """
+        :return: (found, the result read from a spill file), which is removed
+        """
+        try:
+            with open(path, 'rb') as fh:
+                return True, pickle.load(fh)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            logging.warning('cannot read cached result %s: %s' % (path, e))
+            return False, None
+        finally:
+            _remove(path)
+
+    def __store(self, key, expires, tables, value):
+        """
+        :return: the evicted entries (key, expires, tables, value) to spill
+        """
+        self.__entries[key] = (expires, tables, value)
+        evicted = []
+        while len(self.__entries) > self.max_entries:
+            old_key, (old_expires, old_tables, old_value) = \
+                self.__entries.popitem(last=False)
+            self.__stats['evicted'] += 1
+            if self.spill_dir and old_expires > time.time():
+                evicted.append((old_key, old_expires, old_tables, old_value))
+        return evicted
+
+    def __spill(self, evicted, invalidations):
+        """
+        write the evicted results to spill_dir, without holding the lock
+        """
+        for key, expires, tables, value in evicted:
+            name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+            path = os.path.join(self.spill_dir, name + '.pkl')
+            try:
+                tmp = '%s.%d.%d.tmp' % (path, os.getpid(),
+                                        threading.get_ident())
+                with open(tmp, 'wb') as fh:
+                    pickle.dump(value, fh, pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp, path)
+            except OSError as e:
+                logging.warning('cannot spill cached result: %s' % e)
+                continue
+            removed = []
+            with self.__lock:
+                if invalidations != self.__invalidations:
+                    # it may be stale
+                    removed.append(path)
+                else:
+                    self.__spilled[key] = (expires, tables, path)
+                    self.__stats['spilled'] += 1
+                    while len(self.__spilled) > self.max_spilled:
+                        removed.append(
+                            self.__spilled.popitem(last=False)[1][2])
+            for path in removed:
+                _remove(path)
+
+    def fetch(self, query_string, context, run):
+        """
+        :param context: what the result depends on besides the query text
+        :param run: called to run the query if its result is not cached
+        :return: a copy of the cached or new result
+        """
+        query = _normalize_query(query_string)
+        key = (query,) + tuple(context)
+        with self.__lock:
+            found, value = self.__lookup(key)
+            if found:
+                return _copy(value)
+            spilled = value
+            future = self.__running.get(key)
+            if future is None:
+                future = self.__running[key] = Future()
+                owner = True
+                invalidations = self.__invalidations
+            else:
+                owner = False
+                self.__stats['shared'] += 1
+        if not owner:
+            if spilled is not None:
+                _remove(spilled[2])
+            return _copy(future.result())
+
+        try:
+            # the spill file is read without the lock, like the query runs
+            found, value = self.__load(spilled[2]) if spilled is not None \
+                else (False, None)
+            with self.__lock:
+                self.__stats['disk_hits' if found else 'misses'] += 1
+            if found:
+                expires = spilled[0]
+            else:
+                value = run()
+                expires = time.time() + self.ttl
+        except BaseException as e:
+            with self.__lock:
+                del self.__running[key]
+            future.set_exception(e)
+            raise
+        evicted = ()
+        with self.__lock:
+            del self.__running[key]
+            # not kept when invalidated meanwhile, it may be stale
+            if invalidations == self.__invalidations:
+                tables = spilled[1] if found else frozenset(
+                    _table_name(t) for t in _TABLES.findall(query))
+                evicted = self.__store(key, expires, tables, value)
+        future.set_result(value)
+        if evicted:
+            self.__spill(evicted, invalidations)
+        return _copy(value)
+
+    def invalidate(self, table=None):
+        """
+        drop the cached results of the queries reading table, given as in
+        the queries (e.g. dfs.tmp.`sales`, or just sales), or all of them.
+        :return: the number of results dropped
+        """
+        name = _table_name(table) if table else None
+
+        def reads(tables):
+            return name is None or any(
+                t == name or t.endswith('.' + name) for t in tables)
+
+        with self.__lock:
+            self.__invalidations += 1
+            dropped = 0
+            for key, entry in list(self.__entries.items()):
+                if reads(entry[1]):
+                    del self.__entries[key]
+                    dropped += 1
+            for key, entry in list(self.__spilled.items()):
+                if reads(entry[1]):
+                    del self.__spilled[key]
+                    _remove(entry[2])
+                    dropped += 1
+            self.__stats['invalidated'] += dropped
+        return dropped
+
+    def stats(self):
+        """
+        :return: a dict of the hits (in memory and on disk), misses, queries
+            shared with a running one, expired, evicted, spilled and
+            invalidated results, and the number of results cached
+        """
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats['entries'] = len(self.__entries)
+            stats['spilled_entries'] = len(self.__spilled)
+        return stats
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+_CTAS = re.compile(r'^create\s+(?:or\s+replace\s+)?(?:temporary\s+)?table\b',
+                   re.I)
+_ALTER_SESSION = re.compile(r'^alter\s+session\b', re.I)
+_SET_OPTION = re.compile(r"^alter\s+session\s+set\s+`?([\w.]+)`?\s*=\s*"
+                         r"'?([^';]*)'?$", re.I)
+
+
+def _expired(response):
+    """
+    drill answers the queries of an expired session with its login page.
+    """
+    return 'text/html' in response.headers.get('Content-Type', '') or \
+        response.url.rstrip('/').endswith('/login')
+
+
+class _DrillSession(object):
+    """
+    a drill web session: the kept alive connections, the session cookie and
+    the options set by ALTER SESSION, shared by the clients of the same
+    host and user.
+    """
+
+    def __init__(self):
+        self.http = requests.Session()
+        self.pool_size = 0
+        # incremented by each login, to log in once when several queries
+        # find the session expired at the same time
+        self.logins = 0
+        self.cookies = None
+        # option -> value set in the current session
+        self.options = {}
+        self.login_lock = threading.Lock()
+        # held while the options of a CTAS are set and it runs, and by
+        # login, so that no new session starts in between
+        self.options_lock = threading.RLock()
+
+    def fit(self, pool_size):
+        with self.login_lock:
+            if pool_size > self.pool_size:
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=pool_size)
+                self.http.mount('http://', adapter)
+                self.http.mount('https://', adapter)
+                self.pool_size = pool_size
+
+    def login(self, login_service, user, pwd, logins, retries, backoff):
+        """
+        log in unless another thread did since logins was read; connection
+        errors and 5xx replies are retried with an exponential backoff.
+        """
+        with self.login_lock, self.options_lock:
+            if logins != self.logins:
+                return
+            for attempt in range(retries + 1):
+                try:
+                    response = self.http.post(
+                        login_service, {
+                            'j_username': user,
+                            'j_password': pwd
+                        }
+                    )
+                except requests.RequestException as e:
+                    if attempt == retries:
+                        raise
+                    error = e
+                else:
+                    if (response.status_code == 200 and
+                            response.text.find('Log Out') > -1):
+                        self.cookies = response.cookies
+                        self.options = {}
+                        self.logins += 1
+                        return
+                    if response.status_code < 500 or attempt == retries:
+                        raise DrillRemoteException('invalid login credential')
+                    error = response.status_code
+                delay = backoff * 2 ** attempt
+                logging.warning('cannot log in to drill, retry in %ss: %s'
+                                % (delay, error))
+                time.sleep(delay)
+
+
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def _shared_session(host, user, pwd):
+    with _SESSIONS_LOCK:
+        key = (host, user, pwd)
+        session = _SESSIONS.get(key)
+        if session is None:
+            session = _SESSIONS[key] = _DrillSession()
+        return session
+
+
 class DrillRestfulClient(object):
-    def __init__(self, host, user, pwd):
+    def __init__(self, host, user, pwd, parallelism=4, cache=None,
+                 retries=3, backoff=0.5):
+        """
+        no request is sent here: the client logs in with its first query,
+        and shares its drill session with the other clients of the same
+        host and user.
+        :param parallelism: max number of queries run at once by submit and
+            query_many, and of kept alive connections to drill
+        :param cache: a DrillResultCache for the results of the queries
+        :param retries: times a query is retried after logging in again
+            when the session expired, and a login after a connection error
+        :param backoff: seconds before the second retry, doubled after each
+        """
         host = host.rstrip('/')
+        self.host = host
         self.login_service = host + '/j_security_check'
         self.query_service = host + '/query.json'
 
         self.user = user
         self.pwd = pwd
-        self.cookies = None
-        self.store_format = None
+        # the store format of CTAS statements, set in the session before
+        # them only
+        self.store_format = 'parquet'
         self.headers = {'Content-type': 'application/json'}
-        self.__initial_session('parquet')
-
-    def __initial_session(self, default_store_format=None):
-        response = requests.post(
-            self.login_service, {
-                'j_username': self.user,
-                'j_password': self.pwd
-            }
-        )
-        if (response.status_code == 200 and
-            response.content.find('Log Out') > -1):
-            self.cookies = response.cookies
-            self.alter_store_format(default_store_format)
-        else:
-            raise DrillRemoteException('invalid login credential')
+        self.parallelism = parallelism
+        self.cache = cache
+        self.retries = retries
+        self.backoff = backoff
+        self.__session = _shared_session(host, user, pwd)
+        self.__session.fit(parallelism)
+        self.session = self.__session.http
+        self.__executor = None
+        self.__lock = threading.RLock()
 
-    def alter_store_format(self, store_format):
-        if store_format and store_format != self.store_format:
-            logging.info('alter store format as %s' % store_format)
-            # no error will be returned for invalid format...
-            self.query(
-                "ALTER SESSION SET `store.format` = '%s'" % store_format,
-                as_frame=False
-            )
-            self.store_format = store_format
+    @property
+    def cookies(self):
+        return self.__session.cookies
 
-    def query(self, query_string, store_format=None, as_frame=True):
+    def __login(self, logins):
+        self.__session.login(self.login_service, self.user, self.pwd, logins,
+                             self.retries, self.backoff)
+
+    def alter_store_format(self, store_format):
         """
-        :param query_string: the SQL query string.
-        :param store_format: set store format for CTAS operation.
-        :param as_frame: if true it will wrap the result into a pandas dataframe
-        :return: the query result or raise exception if error happened.
+        set the default store format of the CTAS statements, the session is
+        altered right before the first one, if it is not set already.
         """
+        if store_format:
+            self.store_format = store_format
 
-        self.alter_store_format(store_format)
+    def __send(self, query_string, stream=False):
         logging.info(query_string)
         _query = query_string.strip()
         if _query.endswith(';'):
@@ -65,30 +596,231 @@ class DrillRestfulClient(object):
             'queryType': 'SQL',
             'query': _query
         }
-        response = requests.post(
+        response = self.session.post(
             self.query_service,
             data=json.dumps(data),
             headers=self.headers,
-            cookies=self.cookies
+            stream=stream
         )
-        if response.status_code == 200:
-            try:
-                result = json.loads(response.content)
-            except ValueError:
-                logging.warning('session may have been expired, '
-                                'reconnect and try again.',
-                                exc_info=True)
-                self.__initial_session()
-                return self.query(query_string, store_format, as_frame)
-            else:
-                rows = result.get('rows')
-                if as_frame:
-                    return DataFrame.from_records(rows)
-                else:
-                    return rows
-        elif response.status_code == 500:
+        if response.status_code == 500:
             # wrap errorMessage in the exception
             raise DrillRemoteException(response.content)
-        else:
+        elif response.status_code != 200:
             raise DrillRemoteException('%s: %s' %
                                        (response.status_code, response.reason))
+        return response
+
+    def __set_options(self, options):
+        """
+        :return: None or the response of an expired session
+        """
+        session = self.__session
+        for name, value in options.items():
+            if session.options.get(name) != value:
+                logging.info('alter %s as %s' % (name, value))
+                # no error will be returned for invalid format...
+                response = self.__send(
+                    "ALTER SESSION SET `%s` = '%s'" % (name, value))
+                if _expired(response):
+                    return response
+                session.options[name] = value
+
+    def __execute(self, query_string, stream=False, store_format=None):
+        """
+        send a query, logging in before if needed, and again if the session
+        expired, and setting the store format before a CTAS.
+        :param store_format: the store format of a CTAS, self.store_format
+            by default
+        :return: (response, its json unless stream)
+        """
+        session = self.__session
+        statement = _normalize_query(query_string)
+        store_format = store_format or self.store_format
+        options = {}
+        if store_format and _CTAS.match(statement):
+            options['store.format'] = store_format
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            logins = session.logins
+            if not logins:
+                self.__login(logins)
+                logins = session.logins
+            if options:
+                # no other thread may change the options between the ALTER
+                # SESSION and the CTAS, the other queries do not need them
+                with session.options_lock:
+                    response = self.__set_options(options)
+                    if response is None:
+                        response = self.__send(query_string, stream)
+            else:
+                response = self.__send(query_string, stream)
+            if not _expired(response):
+                if stream:
+                    return response, None
+                try:
+                    result = json.loads(response.content)
+                except ValueError:
+                    pass
+                else:
+                    if _ALTER_SESSION.match(statement):
+                        with session.options_lock:
+                            # not if it was sent to the session before
+                            # another thread logged in again
+                            if session.logins == logins:
+                                m = _SET_OPTION.match(statement)
+                                if m:
+                                    session.options[m.group(1)] = m.group(2)
+                                else:  # RESET...
+                                    session.options = {}
+                    return response, result
+            response.close()
+            if attempt == self.retries:
+                break
+            logging.warning('session may have been expired, '
+                            'reconnect and try again.')
+            self.__login(logins)
+        raise DrillRemoteException('drill session expired, logged in again '
+                                   '%d times' % self.retries)
+
+    def query(self, query_string, store_format=None, as_frame=True,
+              chunk_rows=None):
+        """
+        :param query_string: the SQL query string.
+        :param store_format: the store format of a CTAS operation,
+            self.store_format by default
+        :param as_frame: if true it will wrap the result into a pandas dataframe
+        :param chunk_rows: build the dataframe from the chunks of iterquery,
+            which takes much less memory for large results
+        :return: the query result or raise exception if error happened.
+        """
+        if self.cache is None:
+            return self.__query(query_string, store_format, as_frame,
+                                chunk_rows)
+        if not self.cache.cacheable(query_string):
+            result = self.__query(query_string, store_format, as_frame,
+                                  chunk_rows)
+            table = _written_table(query_string)
+            if table:
+                self.cache.invalidate(table)
+            return result
+
+        if not as_frame:
+            kind = 'rows'
+        else:
+            kind = 'typed frame' if chunk_rows else 'frame'
+        return self.cache.fetch(
+            query_string,
+            (self.host, self.user, store_format or self.store_format, kind),
+            lambda: self.__query(query_string, store_format, as_frame,
+                                 chunk_rows))
+
+    def __query(self, query_string, store_format, as_frame, chunk_rows):
+        if as_frame and chunk_rows:
+            chunks = list(self.iterquery(query_string, store_format,
+                                         chunk_rows))
+            return concat(chunks, ignore_index=True) if chunks \
+                else DataFrame()
+
+        _, result = self.__execute(query_string, store_format=store_format)
+        rows = result.get('rows')
+        if as_frame:
+            return DataFrame.from_records(rows)
+        else:
+            return rows
+
+    def iterquery(self, query_string, store_format=None, chunk_rows=65536,
+                  typed=False, chunk_size=1 << 16):
+        """
+        run a query and yield its result as dataframes of chunk_rows rows at
+        most. The response is decoded as it is received, so the memory used
+        is bounded by the size of a chunk rather than of the whole result.
+        The numeric columns are typed by the column types drill sends in the
+        metadata of the result, and keep their type in every chunk.
+        :param typed: without metadata, convert the columns whose values in
+            the first chunk are all numbers, which drill may send as text,
+            to numeric columns; a ValueError is raised if a later chunk has
+            other values in them
+        :param chunk_size: bytes read from the response at a time
+        """
+        response, _ = self.__execute(query_string, stream=True,
+                                     store_format=store_format)
+        with response:
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            text = chain((decoder.decode(chunk) for chunk in
+                          response.iter_content(chunk_size)),
+                         [decoder.decode(b'', True)])
+            entries = _iter_result(text)
+            try:
+                entry = next(entries, None)
+            except ValueError as e:
+                raise DrillRemoteException('invalid query result: %s' % e)
+
+            columns, rows, dtypes = None, [], {} if typed else None
+            framed = False
+            while entry is not None:
+                key, value = entry
+                if key == 'columns':
+                    columns = value
+                elif key == 'metadata' and columns and not framed:
+                    dtypes = _metadata_dtypes(columns, value)
+                elif key == 'rows':
+                    rows.append(value)
+                    if len(rows) >= chunk_rows:
+                        yield _frame(columns, rows, dtypes)
+                        framed, rows = True, []
+                entry = next(entries, None)
+            if rows:
+                yield _frame(columns, rows, dtypes)
+
+    def submit(self, query_string, store_format=None, as_frame=True):
+        """
+        run a query in the background, see query.
+        :return: a concurrent.futures.Future of the query result
+        """
+        with self.__lock:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(self.parallelism)
+        return self.__executor.submit(self.query, query_string,
+                                      store_format, as_frame)
+
+    def query_many(self, query_strings, store_format=None, as_frame=True,
+                   return_exceptions=False):
+        """
+        run independent queries at once, at most parallelism of them at a
+        time, over the same drill session.
+        :param store_format: the store format of the CTAS statements of
+            these queries only, self.store_format by default
+        :param return_exceptions: return the exception of a failed query in
+            its place instead of raising the first one
+        :return: the query results, in the order of the queries
+        """
+        futures = [self.submit(q, store_format, as_frame)
+                   for q in query_strings]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                if not return_exceptions:
+                    for f in futures:
+                        f.cancel()
+                    raise
+                results.append(e)
+        return results
+
+    def close(self):
+        """
+        stop the background queries; the drill session is kept for the
+        other clients.
+        """
+        with self.__lock:
+            if self.__executor is not None:
+                self.__executor.shutdown()
+                self.__executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
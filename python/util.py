@@ -1,8 +1,17 @@
 # coding=utf-8
 
 import os
+import bz2
 import six
+import gzip
+import json
+import lzma
+import mmap
+import time
+import queue
+import signal
 import logging
+import threading
 import smtplib
 import subprocess
 import mimetypes
@@ -14,6 +23,8 @@ from email.mime.image import MIMEImage
 from email.mime.audio import MIMEAudio
 from email.mime.multipart import MIMEMultipart
 from functools import partial
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque, namedtuple, OrderedDict
 
 
 def T(v, null_literal='None', encoding='utf-8'):
@@ -36,50 +47,103 @@ def T(v, null_literal='None', encoding='utf-8'):
     return s
 
 
-def send_mail(mail_config, subject, mail_list, content, *files):
+def _text_converter(cls, null_literal, encoding, failed):
+    """
+    the conversion of T for the values of type cls.
+    """
+    if cls is type(None):
+        null = T(None, null_literal, encoding)
+        return lambda v: null
+    if issubclass(cls, six.text_type):
+        return lambda v: v
+    if issubclass(cls, (six.binary_type, six.string_types)):
+        def decode(v):
+            try:
+                return v.decode(encoding)
+            except UnicodeDecodeError:
+                failed.append(v)
+                return None
+        return decode
+    return six.text_type
 
-    def make_attachment(path):
-        ctype, encoding = mimetypes.guess_type(path)
-        if ctype:
-            maintype, subtype = ctype.split('/', 1)
-            if maintype == 'text':
-                mime_cls = partial(MIMEText,
-                                   _charset=encoding if encoding else 'utf-8')
-            elif maintype == 'image':
-                mime_cls = MIMEImage
-            elif maintype == 'audio':
-                mime_cls = MIMEAudio
-            else:
-                mime_cls = partial(MIMEBase, maintype, subtype)
-        else:
+
+def T_many(values, null_literal='None', encoding='utf-8', failed=None):
+    """
+    T applied to many values, e.g. the cells of a column, faster: the
+    conversion is looked up once per type and str values are kept as they
+    are. The values that can not be decoded become None and are reported
+    in one log message, or added to failed if it is a list.
+    :return: a list of the values as text
+    """
+    report = failed is None
+    if report:
+        failed = []
+    converters = {}
+    get = converters.get
+
+    def convert(v):  # the first value of a type
+        cls = type(v)
+        converters[cls] = _text_converter(cls, null_literal, encoding, failed)
+        return converters[cls](v)
+
+    texts = [v if type(v) is str else (get(type(v)) or convert)(v)
+             for v in values]
+    if report and failed:
+        logging.error('cannot convert %d values to string, e.g.: %s'
+                      % (len(failed), failed[:5]))
+    return texts
+
+
+def _make_attachment(path):
+    ctype, encoding = mimetypes.guess_type(path)
+    if ctype:
+        maintype, subtype = ctype.split('/', 1)
+        if maintype == 'text':
             mime_cls = partial(MIMEText,
                                _charset=encoding if encoding else 'utf-8')
-            subtype = 'plain'
-
-        with open(path, 'rb') as fh:
-            if mime_cls == MIMEBase or \
-                    getattr(mime_cls, 'func', None) == MIMEBase:
-                attachment = mime_cls()
-                attachment.set_payload(fh.read())
-                encoders.encode_base64(attachment)
-            else:
-                attachment = mime_cls(fh.read(), _subtype=subtype)
+        elif maintype == 'image':
+            mime_cls = MIMEImage
+        elif maintype == 'audio':
+            mime_cls = MIMEAudio
+        else:
+            mime_cls = partial(MIMEBase, maintype, subtype)
+    else:
+        mime_cls = partial(MIMEText,
+                           _charset=encoding if encoding else 'utf-8')
+        subtype = 'plain'
 
-        attachment.add_header('Content-Disposition',
-                              'attachment',
-                              filename=os.path.basename(path))
-        return attachment
+    with open(path, 'rb') as fh:
+        if mime_cls == MIMEBase or \
+                getattr(mime_cls, 'func', None) == MIMEBase:
+            attachment = mime_cls()
+            attachment.set_payload(fh.read())
+            encoders.encode_base64(attachment)
+        else:
+            attachment = mime_cls(fh.read(), _subtype=subtype)
+
+    attachment.add_header('Content-Disposition',
+                          'attachment',
+                          filename=os.path.basename(path))
+    return attachment
 
+
+def _make_message(sender, subject, mail_list, content, attachments):
+    message = MIMEMultipart()
+    _subtype = 'html' if '</html>' in content else 'plain'
+    message.attach(MIMEText(content, _subtype, 'utf-8'))
+    message["Subject"] = subject
+    message["From"] = sender
+    message["To"] = ";".join(mail_list)
+    for attachment in attachments:
+        message.attach(attachment)
+    return message
+
+
+def send_mail(mail_config, subject, mail_list, content, *files):
     try:
-        message = MIMEMultipart()
-        _subtype = 'html' if '</html>' in content else 'plain'
-        message.attach(MIMEText(content, _subtype, 'utf-8'))
-        message["Subject"] = subject
-        message["From"] = mail_config['user']
-        message["To"] = ";".join(mail_list)
-        for f in files:
-            if os.path.exists(f):
-                message.attach(make_attachment(f))
+        message = _make_message(mail_config['user'], subject, mail_list,
+                                content, [_make_attachment(f) for f in files
+                                          if os.path.exists(f)])
 
         client = smtplib.SMTP()
         client.connect(mail_config['host'], mail_config['port'])
@@ -95,6 +159,235 @@ def send_mail(mail_config, subject, mail_list, content, *files):
         raise
 
 
+def _transient(e):
+    """
+    whether sending a mail may succeed again after the error e: 4xx replies,
+    lost connections and socket errors. Other errors are raised at once.
+    """
+    if isinstance(e, smtplib.SMTPResponseException):
+        return 400 <= e.smtp_code < 500
+    if isinstance(e, smtplib.SMTPServerDisconnected):
+        return True
+    # SMTPException is an OSError too
+    return isinstance(e, OSError) and \
+        not isinstance(e, smtplib.SMTPException)
+
+
+class MailSender(object):
+    """
+    send mails as send_mail does, over a pool of smtp connections which are
+    connected and logged in once and then reused, e.g.
+        with MailSender(mail_config) as sender:
+            for user, report in reports:
+                sender.submit('daily report', [user], content, report)
+    - send delivers at once, submit queues the mail for background workers
+      and returns a concurrent.futures.Future
+    - transient errors (4xx replies, lost connections, socket errors) are
+      retried with an exponential backoff
+    - attachments are encoded once and shared by the mails attaching them
+    mail_config is the one of send_mail, with an optional 'timeout'. The
+    login is skipped when there is no 'password', e.g. to test against a
+    local smtp server.
+    """
+
+    def __init__(self, mail_config, connections=2, retries=3, backoff=1.0,
+                 max_idle=60.0, max_attachments=64):
+        """
+        :param connections: max number of open connections, which is also
+            the number of background workers
+        :param retries: retries of a mail after a transient error
+        :param backoff: seconds before the first retry, doubled after each
+        :param max_idle: seconds after which an idle connection is checked
+            with a NOOP before being reused
+        :param max_attachments: encoded attachments kept for later mails,
+            the least recently used are dropped first
+        """
+        self.__config = mail_config
+        self.__connections = connections
+        self.__retries = retries
+        self.__backoff = backoff
+        self.__max_idle = max_idle
+        # (client, last used), the most recently used first
+        self.__idle = queue.LifoQueue()
+        self.__slots = threading.BoundedSemaphore(connections)
+        self.__jobs = queue.Queue()
+        self.__workers = []
+        self.__lock = threading.Lock()
+        # (path, mtime, size) -> encoded attachment, so that a changed file
+        # is encoded again
+        self.__attachments = OrderedDict()
+        self.__max_attachments = max_attachments
+
+    def __connect(self):
+        config = self.__config
+        client = smtplib.SMTP(timeout=config.get('timeout', 60))
+        try:
+            client.connect(config['host'], config['port'])
+            if config.get('use-ssl', False):
+                client.starttls()
+            if config.get('password'):
+                client.login(config['user'], config['password'])
+        except:
+            client.close()
+            raise
+        return client
+
+    def __acquire(self):
+        self.__slots.acquire()
+        try:
+            while True:
+                try:
+                    client, used = self.__idle.get_nowait()
+                except queue.Empty:
+                    return self.__connect()
+                if time.time() - used < self.__max_idle:
+                    return client
+                try:
+                    client.noop()
+                    return client
+                except (smtplib.SMTPException, OSError):
+                    client.close()
+        except:
+            self.__slots.release()
+            raise
+
+    def __release(self, client, broken=False):
+        if broken:
+            client.close()
+        else:
+            self.__idle.put((client, time.time()))
+        self.__slots.release()
+
+    def __deliver(self, recipients, text):
+        sender = self.__config['user']
+        for attempt in range(self.__retries + 1):
+            client = None
+            try:
+                client = self.__acquire()
+                refused = client.sendmail(sender, recipients, text)
+            except Exception as e:
+                if client is not None:
+                    # the connection is still usable after an error reply
+                    replied = isinstance(e, (smtplib.SMTPResponseException,
+                                             smtplib.SMTPRecipientsRefused))
+                    self.__release(client, broken=not replied or
+                                   getattr(e, 'smtp_code', None) == 421)
+                if attempt == self.__retries or not _transient(e):
+                    raise
+                delay = self.__backoff * 2 ** attempt
+                logging.warning('error in sending email, retry in %ss: %s'
+                                % (delay, e))
+                time.sleep(delay)
+            else:
+                self.__release(client)
+                return refused
+
+    def __attachment(self, path):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        with self.__lock:
+            attachment = self.__attachments.get(key)
+            if attachment is not None:
+                self.__attachments.move_to_end(key)
+                return attachment
+        attachment = _make_attachment(path)
+        with self.__lock:
+            self.__attachments[key] = attachment
+            while len(self.__attachments) > self.__max_attachments:
+                self.__attachments.popitem(last=False)
+        return attachment
+
+    def send(self, subject, mail_list, content, *files, separate=False):
+        """
+        send a mail, see send_mail.
+        :param separate: send one mail to each recipient instead of one mail
+            to all of them, still over one connection
+        :return: the refused recipients, as smtplib.SMTP.sendmail
+        """
+        attachments = [self.__attachment(f) for f in files
+                       if os.path.exists(f)]
+        sender = self.__config['user']
+        if not separate:
+            message = _make_message(sender, subject, mail_list, content,
+                                    attachments)
+            return self.__deliver(mail_list, message.as_string())
+
+        # the idle connections are reused most recent first, so the mails go
+        # over one connection as long as it works
+        refused = {}
+        for recipient in mail_list:
+            message = _make_message(sender, subject, [recipient], content,
+                                    attachments)
+            refused.update(self.__deliver([recipient], message.as_string()))
+        return refused
+
+    def __work(self):
+        while True:
+            job = self.__jobs.get()
+            try:
+                if job is None:
+                    return
+                future, args, kwargs = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(self.send(*args, **kwargs))
+                except Exception as e:
+                    logging.error('error in sending email: %s' % e)
+                    future.set_exception(e)
+            finally:
+                self.__jobs.task_done()
+
+    def submit(self, subject, mail_list, content, *files, separate=False):
+        """
+        queue a mail to be sent in the background, see send.
+        :return: a concurrent.futures.Future of the refused recipients
+        """
+        with self.__lock:
+            if not self.__workers:
+                for _ in range(self.__connections):
+                    worker = threading.Thread(target=self.__work, daemon=True)
+                    worker.start()
+                    self.__workers.append(worker)
+        future = Future()
+        self.__jobs.put((future, (subject, mail_list, content) + files,
+                         {'separate': separate}))
+        return future
+
+    def join(self):
+        """
+        wait for the queued mails to be sent.
+        """
+        self.__jobs.join()
+
+    def close(self):
+        """
+        send the queued mails, stop the workers and quit the connections.
+        """
+        with self.__lock:
+            for _ in self.__workers:
+                self.__jobs.put(None)
+            for worker in self.__workers:
+                worker.join()
+            self.__workers = []
+            self.__attachments.clear()
+        while True:
+            try:
+                client, _ = self.__idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                client.quit()
+            except (smtplib.SMTPException, OSError):
+                client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 def shell(cmd, ignore_output=True):
     p = subprocess.Popen(cmd,
                          shell=True,
@@ -113,6 +406,227 @@ def shell(cmd, ignore_output=True):
         return p.returncode, out, err
 
 
+ShellResult = namedtuple('ShellResult', ['cmd', 'returncode', 'seconds',
+                                         'timed_out', 'cancelled'])
+
+
+class _ShellJob(object):
+    __slots__ = ('cmd', 'process', 'timed_out', 'cancelled', 'error')
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.process = None
+        self.timed_out = False
+        self.cancelled = False
+        self.error = None
+
+
+def _kill(process):
+    if process.returncode is not None:
+        # reaped already, its pid may belong to another process by now
+        return
+    try:
+        if hasattr(os, 'killpg'):
+            # the shell and everything it started
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except OSError:  # already gone
+        pass
+
+
+def _line_sink(sink, level):
+    if sink is None:
+        return lambda line: logging.log(level, line)
+    if hasattr(sink, 'write'):
+        return lambda line: sink.write(line + '\n')
+    return sink
+
+
+def _pump(job, fh, sink):
+    try:
+        for line in fh:
+            sink(line.rstrip('\r\n'))
+    except Exception as e:
+        # stop the command, its output can not go anywhere
+        job.error = job.error or e
+        _kill(job.process)
+        for _ in fh:
+            pass
+
+
+class ShellExecutor(object):
+    """
+    run many shell commands at once, as shell does, e.g.
+        with ShellExecutor(workers=8, timeout=600) as executor:
+            for result in executor.map(commands, stdout=log_file):
+                ...
+    - at most workers commands run at the same time
+    - the output is handed line by line to callbacks or written to files,
+      instead of being held in memory
+    - a command is killed, with the processes it started, when it times out
+      or is cancelled
+    - each command gives a ShellResult with its exit status and wall time,
+      metrics sums them up
+    """
+
+    def __init__(self, workers=None, timeout=None, encoding='utf-8'):
+        """
+        :param workers: max number of commands running, the number of cpus
+            by default
+        :param timeout: default seconds after which a command is killed
+        :param encoding: of the output of the commands, undecodable bytes
+            are replaced
+        """
+        self.__pool = ThreadPoolExecutor(workers or os.cpu_count() or 1)
+        self.__timeout = timeout
+        self.__encoding = encoding
+        self.__jobs = {}
+        self.__lock = threading.Lock()
+        self.__metrics = {'commands': 0, 'succeeded': 0, 'failed': 0,
+                          'timed_out': 0, 'cancelled': 0,
+                          'total_seconds': 0.0, 'max_seconds': 0.0}
+
+    def __run(self, job, stdout, stderr, timeout):
+        start = time.time()
+        job.process = subprocess.Popen(job.cmd,
+                                       shell=True,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE,
+                                       encoding=self.__encoding,
+                                       errors='replace',
+                                       start_new_session=True)
+        if job.cancelled:  # cancelled while starting
+            _kill(job.process)
+        timer = None
+        if timeout:
+            def expire():
+                job.timed_out = True
+                _kill(job.process)
+
+            timer = threading.Timer(timeout, expire)
+            timer.daemon = True
+            timer.start()
+        err = threading.Thread(target=_pump, daemon=True,
+                               args=(job, job.process.stderr,
+                                     _line_sink(stderr, logging.ERROR)))
+        err.start()
+        try:
+            _pump(job, job.process.stdout, _line_sink(stdout, logging.DEBUG))
+            err.join()
+            returncode = job.process.wait()
+        finally:
+            if timer:
+                timer.cancel()
+            job.process.stdout.close()
+            job.process.stderr.close()
+        result = ShellResult(job.cmd, returncode, time.time() - start,
+                             job.timed_out, job.cancelled)
+        logging.info('%s -> %s' % (job.cmd, returncode))
+        self.__record(result)
+        if job.error:
+            raise job.error
+        return result
+
+    def __record(self, result):
+        with self.__lock:
+            metrics = self.__metrics
+            metrics['commands'] += 1
+            if result.cancelled:
+                metrics['cancelled'] += 1
+            elif result.timed_out:
+                metrics['timed_out'] += 1
+            elif result.returncode == 0:
+                metrics['succeeded'] += 1
+            else:
+                metrics['failed'] += 1
+            metrics['total_seconds'] += result.seconds
+            metrics['max_seconds'] = max(metrics['max_seconds'],
+                                         result.seconds)
+
+    def submit(self, cmd, stdout=None, stderr=None, timeout=None):
+        """
+        :param cmd: a shell command
+        :param stdout: called with each line of the output, without its line
+            end, or a file the lines are written to; logged at debug level by
+            default
+        :param stderr: the same for the error output, logged at error level
+            by default
+        :param timeout: seconds after which the command is killed, the one of
+            the executor by default
+        :return: a concurrent.futures.Future of the ShellResult
+        """
+        job = _ShellJob(cmd)
+        future = self.__pool.submit(self.__run, job, stdout, stderr,
+                                    timeout or self.__timeout)
+        with self.__lock:
+            self.__jobs[future] = job
+        future.add_done_callback(self.__done)
+        return future
+
+    def __done(self, future):
+        with self.__lock:
+            job = self.__jobs.pop(future, None)
+        if future.cancelled() and job is not None:
+            self.__record(ShellResult(job.cmd, None, 0.0, False, True))
+
+    def map(self, cmds, **kwargs):
+        """
+        run the commands, see submit, and yield their ShellResult in order.
+        """
+        futures = [self.submit(cmd, **kwargs) for cmd in cmds]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                if not future.done():
+                    self.cancel(future)
+
+    def cancel(self, future):
+        """
+        cancel a command, killing it if it is running.
+        :return: false if it was already done
+        """
+        if future.cancel():
+            return True
+        if future.done():
+            return False
+        with self.__lock:
+            job = self.__jobs.get(future)
+        if job is None:
+            return False
+        job.cancelled = True
+        if job.process is not None:
+            _kill(job.process)
+        return True
+
+    def metrics(self):
+        """
+        :return: a dict of the number of commands run, succeeded, failed,
+            timed out and cancelled, and of their total and max wall time
+        """
+        with self.__lock:
+            return dict(self.__metrics)
+
+    def shutdown(self, wait=True, cancel=False):
+        """
+        :param cancel: cancel the commands not done yet
+        """
+        if cancel:
+            with self.__lock:
+                futures = list(self.__jobs)
+            for future in futures:
+                self.cancel(future)
+        self.__pool.shutdown(wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(cancel=exc_type is not None)
+
+
 def stream(paths, func_accept_file=None):
     def default_accept(container_path, name):
         return name
@@ -142,3 +656,278 @@ def stream(paths, func_accept_file=None):
                         yield line
         except OSError as e:
             logging.error("error in reading file %s: %s" % (path, e))
+
+
+_OPENERS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+    '.lzma': lzma.open,
+}
+
+
+def _list_files(paths, func_accept_file, recursive):
+    def walk(path):
+        with os.scandir(path) as entries:
+            entries = sorted(entries, key=lambda e: e.name)
+        for entry in entries:
+            if entry.is_dir():
+                if recursive:
+                    for f in walk(entry.path):
+                        yield f
+            elif func_accept_file(path, entry.name):
+                yield entry.path
+
+    if not isinstance(paths, (tuple, list)):
+        paths = [paths, ]
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+        else:
+            for f in walk(path):
+                yield f
+
+
+def _file_blocks(path, start, buffer_size):
+    opener = _OPENERS.get(os.path.splitext(path)[1], open)
+    with opener(path, 'rb') as fh:
+        if start:
+            fh.seek(start)
+        offset, rest = start, b''
+        while True:
+            block = fh.read(buffer_size)
+            if not block:
+                break
+            block = rest + block
+            cut = block.rfind(b'\n') + 1
+            if cut == 0:
+                rest = block
+                continue
+            rest = block[cut:]
+            offset += cut
+            yield memoryview(block)[:cut], offset
+        if rest:
+            yield memoryview(rest), offset + len(rest)
+
+
+def _mmap_blocks(path, start, buffer_size):
+    with open(path, 'rb') as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if size <= start:
+            return
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mm, 'madvise'):
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+    # not closed explicitly: the map is released with the last view on it
+    view = memoryview(mm)
+    pos = start
+    while pos < size:
+        end = pos + buffer_size
+        if end >= size:
+            cut = size
+        else:
+            cut = mm.rfind(b'\n', pos, end) + 1 or mm.find(b'\n', end) + 1
+            cut = cut or size
+        yield view[pos:cut], cut
+        pos = cut
+
+
+def _read_blocks(path, start, buffer_size, raw=False, use_mmap=False,
+                 encoding=None, errors='strict'):
+    """
+    read a file, decompressed according to its extension, from the byte
+    offset start by blocks of about buffer_size cut after a newline; yield
+    (data, offset) for each block where offset is the position right after
+    it and data is
+    - raw: a memoryview of the block
+    - otherwise: the stripped non empty lines of the block, as text if an
+      encoding is given (the block is decoded at once) or as bytes
+    :param use_mmap: map uncompressed files in memory instead of reading them
+    """
+    if use_mmap and os.path.splitext(path)[1] not in _OPENERS:
+        blocks = _mmap_blocks(path, start, buffer_size)
+    else:
+        blocks = _file_blocks(path, start, buffer_size)
+    for block, offset in blocks:
+        if raw:
+            yield block, offset
+            continue
+        block = bytes(block)
+        if encoding:
+            block = block.decode(encoding, errors)
+            lines = [line.strip() for line in block.split('\n')]
+        else:
+            lines = [line.strip() for line in block.split(b'\n')]
+        yield [line for line in lines if line], offset
+
+
+def _produce(files, positions, out, stop, **kwargs):
+    """
+    worker of stream_files: read the files handed out by the files iterator
+    into the out queue as (path, data, offset), then a None. Any other error
+    than a file that cannot be read, e.g. a UnicodeDecodeError, stops the
+    worker and is put in the queue, to be raised by the consumer.
+    """
+    def put(item):
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        for path in files:
+            try:
+                logging.debug('reading file: %s' % path)
+                for data, offset in _read_blocks(path, positions.get(path, 0),
+                                                 **kwargs):
+                    if not put((path, data, offset)):
+                        return
+                put((path, None, -1))
+            except (OSError, EOFError) as e:
+                logging.error("error in reading file %s: %s" % (path, e))
+    except Exception as e:
+        put(e)
+    finally:
+        put(None)
+
+
+def _save_checkpoint(checkpoint, positions):
+    tmp = '%s.%d.tmp' % (checkpoint, os.getpid())
+    with open(tmp, 'w') as fh:
+        json.dump(positions, fh)
+    os.replace(tmp, checkpoint)
+
+
+def stream_files(paths, func_accept_file=None, recursive=True, workers=1,
+                 checkpoint=None, checkpoint_interval=5.0, encoding='utf-8',
+                 errors='strict', buffer_size=1 << 20, queue_size=64,
+                 batch_lines=None, batch_bytes=None, use_mmap=False):
+    """
+    a faster stream: yield the stripped non empty lines of files and of the
+    files found in directories.
+    - directories are walked recursively with os.scandir
+    - *.gz, *.bz2, *.xz and *.lzma files are decompressed
+    - files are read in large binary blocks, decoded a block at a time
+    - several files can be read at once by worker threads, the lines of
+      different files are then interleaved
+    - the position reached in each file can be kept in a checkpoint file, a
+      later call with the same checkpoint resumes from there
+    - lines can be yielded by batches, to be handled in bulk
+    :param paths: a path or a list of paths of files or directories
+    :param func_accept_file: called with (directory, name) for each file
+        found in a directory, the file is read if it returns true
+    :param recursive: walk sub directories as well
+    :param workers: number of threads reading files
+    :param checkpoint: path of a json file of {file: byte offset}, where -1
+        marks a file read to the end. Offsets are saved for whole blocks once
+        all their lines have been consumed, so after a crash up to one block
+        of lines per file may be yielded again. The offsets of compressed
+        files are in the decompressed data, resuming them decompresses the
+        skipped part again.
+    :param checkpoint_interval: seconds between checkpoint saves
+    :param encoding: encoding of the lines, None to yield bytes
+    :param errors: how decoding errors are handled, see bytes.decode
+    :param buffer_size: size of the blocks read
+    :param queue_size: blocks read ahead by the workers
+    :param batch_lines: yield lists of batch_lines lines (the last one may be
+        shorter) instead of single lines
+    :param batch_bytes: yield memoryviews of about batch_bytes bytes of whole
+        lines, as they are in the file (not stripped nor decoded, empty lines
+        kept), e.g. for numpy.loadtxt or pandas.read_csv over io.BytesIO
+    :param use_mmap: map uncompressed files in memory instead of reading them
+    """
+    if batch_lines and batch_bytes:
+        raise ValueError('batch_lines and batch_bytes are exclusive')
+    if not func_accept_file:
+        func_accept_file = lambda container_path, name: name
+
+    positions = {}
+    if checkpoint and os.path.exists(checkpoint):
+        with open(checkpoint) as fh:
+            positions = json.load(fh)
+    # listed up front, so that a bad path fails here as it does in stream
+    files = queue.Queue()
+    for f in _list_files(paths, func_accept_file, recursive):
+        if positions.get(f) != -1:
+            files.put(f)
+
+    def next_file():
+        try:
+            return files.get_nowait()
+        except queue.Empty:
+            return None
+
+    out = queue.Queue(queue_size)
+    stop = threading.Event()
+    threads = [threading.Thread(target=_produce, daemon=True,
+                                args=(iter(next_file, None), positions, out,
+                                      stop),
+                                kwargs={'buffer_size': batch_bytes or
+                                        buffer_size,
+                                        'raw': bool(batch_bytes),
+                                        'use_mmap': use_mmap,
+                                        'encoding': encoding,
+                                        'errors': errors})
+               for _ in range(max(1, workers))]
+    for thread in threads:
+        thread.start()
+
+    def blocks():
+        running = len(threads)
+        while running:
+            item = out.get()
+            if item is None:
+                running -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+
+    saved = [time.time()]
+
+    def consumed(path, offset):
+        positions[path] = offset
+        if checkpoint and time.time() - saved[0] > checkpoint_interval:
+            _save_checkpoint(checkpoint, positions)
+            saved[0] = time.time()
+
+    try:
+        if batch_bytes:
+            for path, data, offset in blocks():
+                if data is not None:
+                    yield data
+                consumed(path, offset)
+        elif batch_lines:
+            # (count, path, offset): the offset is consumed once count lines
+            # have been yielded
+            batch, marks, count, done = [], deque(), 0, 0
+            for path, lines, offset in blocks():
+                if lines:
+                    batch.extend(lines)
+                    count += len(lines)
+                marks.append((count, path, offset))
+                while len(batch) >= batch_lines or \
+                        marks and marks[0][0] <= done:
+                    if len(batch) >= batch_lines:
+                        yield batch[:batch_lines]
+                        del batch[:batch_lines]
+                        done += batch_lines
+                    while marks and marks[0][0] <= done:
+                        consumed(*marks.popleft()[1:])
+            if batch:
+                yield batch
+            for _, path, offset in marks:
+                consumed(path, offset)
+        else:
+            for path, lines, offset in blocks():
+                if lines:
+                    for line in lines:
+                        yield line
+                consumed(path, offset)
+    finally:
+        stop.set()
+        if checkpoint:
+            _save_checkpoint(checkpoint, positions)